@@ -0,0 +1,115 @@
+"""Benchmarks of each stage of the analysis on the bundled replays. Requires pytest-benchmark (pip install age-alyser[benchmark]).
+
+Not collected by the test suite. Baselines are stored in benchmarks/baselines - run from the repo root and compare
+against the stored baseline with:
+    pytest benchmarks --benchmark-storage=benchmarks/baselines --benchmark-compare=0001 --benchmark-compare-fail=mean:20%
+and record a new baseline (e.g. before upgrading mgz or pandas) with:
+    pytest benchmarks --benchmark-storage=benchmarks/baselines --benchmark-save=baseline
+"""
+
+import io
+from pathlib import Path
+
+import pytest
+from mgz.model import parse_match
+
+from agealyser.ingest import match_to_tables
+from agealyser.main import AgeGame, AgeMap, GamePlayer
+from agealyser.utils import ProductionEngine
+
+REPO = Path(__file__).parents[1]
+REPLAYS = {
+    "1v1_arabia": REPO / "tests" / "Test_Games" / "SD-AgeIIDE_Replay_366825453.aoe2record",
+    "1v1": REPO / "Data" / "RawAoe2RecordBytes" / "AOE2ReplayBinary_15.aoe2record",
+    "4v4": REPO / "Data" / "RawAoe2RecordBytes" / "AOE2ReplayBinary_11.aoe2record",
+}
+
+
+@pytest.fixture(scope="module", params=REPLAYS.keys())
+def replay_bytes(request) -> bytes:
+    return REPLAYS[request.param].read_bytes()
+
+
+@pytest.fixture(scope="module")
+def match(replay_bytes):
+    return parse_match(io.BytesIO(replay_bytes))
+
+
+@pytest.fixture(scope="module")
+def game(replay_bytes, tmp_path_factory) -> AgeGame:
+    path = tmp_path_factory.mktemp("replay") / "game.aoe2record"
+    path.write_bytes(replay_bytes)
+    return AgeGame(path)
+
+
+def new_player(game: AgeGame) -> GamePlayer:
+    """Fresh copy of the first player, so that the lazily computed sections are computed again each round"""
+    player = game.players[0]
+    return GamePlayer(
+        number=player.number,
+        name=player.name,
+        civilisation=player.civilisation,
+        starting_position={"x": player.starting_position[0], "y": player.starting_position[1]},
+        actions=game.all_actions_df.loc[game.all_actions_df["player"] == player.number, :].copy(),
+        inputs=game.all_inputs_df.loc[game.all_inputs_df["player"] == player.number, :].copy(),
+        winner=player.player_won,
+        elo=player.elo,
+    )
+
+
+def test_mgz_parse(benchmark, replay_bytes):
+    benchmark(lambda: parse_match(io.BytesIO(replay_bytes)))
+
+
+def test_normalise(benchmark, match):
+    benchmark(match_to_tables, match)
+
+
+def test_metadata_only(benchmark, game):
+    benchmark(AgeGame.metadata_only, game.path_to_game)
+
+
+def test_age_map(benchmark, game):
+    benchmark(
+        lambda: AgeMap(
+            map={**game.map_info, "tiles": game.map_tiles},
+            gaia=game.gaia,
+            player_starting_locations=[
+                tuple(game.players_raw_info[0]["position"].values()),
+                tuple(game.players_raw_info[1]["position"].values()),
+            ],
+        )
+    )
+
+
+def test_production_engine(benchmark, game):
+    player = game.players[0]
+    benchmark(
+        lambda: [
+            building.produce_units()
+            for buildings in ProductionEngine().create_production_buildings(
+                inputs_data=player.inputs_df,
+                player=player.number,
+                position_x=player.starting_position[0],
+                position_y=player.starting_position[1],
+            ).values()
+            for building in buildings or []
+        ]
+    )
+
+
+def test_full_player_choices_and_strategy(benchmark, game):
+    def analyse_player(player: GamePlayer):
+        player.full_player_choices_and_strategy(
+            feudal_time=player.age_up_times[2],
+            castle_time=player.age_up_times[3],
+            loom_time=player.technologies["Loom"],
+            end_of_game=player.actions_df["timestamp"].max(),
+            civilisation=player.civilisation,
+        )
+
+    benchmark.pedantic(analyse_player, setup=lambda: ((new_player(game),), {}), rounds=5)
+
+
+def test_advanced_parser(benchmark, game):
+    benchmark.pedantic(lambda: AgeGame(game.path_to_game).advanced_parser(), rounds=3)
@@ -1 +1,7 @@
-from .main import AgeGame, AgeMap, GamePlayer
\ No newline at end of file
+import logging
+
+from .main import AgeGame, AgeMap, GamePlayer
+from .batch import analyse_many
+
+# Library logging - leave configuring handlers and levels to the application (e.g. the CLI)
+logging.getLogger(__name__).addHandler(logging.NullHandler())
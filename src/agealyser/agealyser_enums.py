@@ -3,9 +3,14 @@ Data for this including some notes and exceptions can be found in the Data folde
 """
 
 import logging
-import warnings
 from enum import Enum
-from typing import Final, List
+from typing import Dict, Final, Iterable, List
+
+import numpy as np
+from mgz.reference import get_dataset
+from mgz.util import Version
+
+from .diagnostics import record
 
 logger = logging.getLogger(__name__)
 
@@ -92,6 +97,100 @@ TownCentreUnitsAndTechs: Final[List[str]] = [
     "Imperial Age",
 ]
 
+# Unique units are trained at the castle, as well as Petards and Trebuchets. Some are also trained at other buildings
+# (e.g. Huskarls at the Barracks) - see ProductionEngine for how a building's type is decided
+CastleUnits: Final[List[str]] = [
+    "Petard",
+    "Trebuchet",
+    "Arambai",
+    "Ballista Elephant",
+    "Berserk",
+    "Boyar",
+    "Camel Archer",
+    "Cataphract",
+    "Centurion",
+    "Chakram Thrower",
+    "Chu Ko Nu",
+    "Composite Bowman",
+    "Conquistador",
+    "Coustillier",
+    "Gbeto",
+    "Genoese Crossbowman",
+    "Ghulam",
+    "Huskarl",
+    "Hussite Wagon",
+    "Jaguar Warrior",
+    "Janissary",
+    "Kamayuk",
+    "Karambit Warrior",
+    "Keshik",
+    "Kipchak",
+    "Konnik",
+    "Leitis",
+    "Longbowman",
+    "Magyar Huszar",
+    "Mameluke",
+    "Mangudai",
+    "Monaspa",
+    "Obuch",
+    "Organ Gun",
+    "Plumed Archer",
+    "Ratha",
+    "Rattan Archer",
+    "Samurai",
+    "Serjeant",
+    "Shotel Warrior",
+    "Tarkan",
+    "Teutonic Knight",
+    "Throwing Axeman",
+    "Urumi Swordsman",
+    "War Elephant",
+    "War Wagon",
+    "Woad Raider",
+]
+
+DonjonUnits: Final[List[str]] = ["Serjeant"]  # TODO Spearman line - shared with the Barracks
+
+KrepostUnits: Final[List[str]] = ["Konnik"]
+
+DockUnits: Final[List[str]] = [
+    "Fishing Ship",
+    "Transport Ship",
+    "Trade Cog",
+    "Galley",
+    "War Galley",
+    "Galleon",
+    "Fire Galley",
+    "Fire Ship",
+    "Fast Fire Ship",
+    "Demolition Raft",
+    "Demolition Ship",
+    "Heavy Demolition Ship",
+    "Cannon Galleon",
+    "Elite Cannon Galleon",
+    "Longboat",
+    "Elite Longboat",
+    "Turtle Ship",
+    "Elite Turtle Ship",
+]
+
+MonasteryUnits: Final[List[str]] = ["Monk", "Missionary"]
+
+# Units (and technologies) of each production building modelled. Order matters - a building whose units match more than
+# one type equally is given the first
+ProductionBuildingUnits: Final[Dict[str, List[str]]] = {
+    "Town Center": TownCentreUnitsAndTechs,
+    "Archery Range": ArcheryRangeUnits,
+    "Barracks": BarracksUnits,
+    "Stable": StableUnits,
+    "Siege Workshop": SiegeWorkshopUnits,
+    "Castle": CastleUnits,
+    "Donjon": DonjonUnits,
+    "Krepost": KrepostUnits,
+    "Dock": DockUnits,
+    "Monastery": MonasteryUnits,
+}
+
 
 class BuildTimesEnum(Enum):
     """Enum of building times with override"""
@@ -148,8 +247,8 @@ class BuildTimesEnum(Enum):
                 # In this case error as MGZ has incorrectly read in a technology or there is a bug in AgeAlyser
                 raise ValueError(f"A Building has been incorrectly parsed by MGZ or there is a bug in AgeAlyser. Please Raise an issue with details on the game (building: {name})")
             else:
-                # In this case I have not updated the AgeAlyser Enums - raise a warning for the user to raise an issue but do not fail
-                warnings.warn(f"A building could not be found in the game data. Please raise an issue on github (building: {name})")
+                # In this case I have not updated the AgeAlyser Enums - tell the user to raise an issue but do not fail
+                record("unknown_building", name)  # Counted and reported once per game, see diagnostics
             return False
         else:
             return True
@@ -383,8 +482,8 @@ class TechnologyResearchTimes(Enum):
                 # In this case error as MGZ has incorrectly read in a technology or there is a bug in AgeAlyser
                 raise ValueError(f"A Technology has been incorrectly parsed by MGZ or there is a bug in AgeAlyser. Please Raise an issue with details on the game (tech: {name})")
             else:
-                # In this case I have not updated the AgeAlyser Enums - raise a warning for the user to raise an issue but do not fail
-                warnings.warn(f"A technology could not be found in the game data. Please raise an issue on github (tech: {name})")
+                # In this case I have not updated the AgeAlyser Enums - tell the user to raise an issue but do not fail
+                record("unknown_technology", name)  # Counted and reported once per game, see diagnostics
             return False
         else:
             return True
@@ -448,14 +547,14 @@ class TechnologyResearchTimes(Enum):
 class UnitCreationTime(Enum):
     # Technologies that are researched at a production building are put in here just so the code is shorter, see the production buildings
     # Town Centre
-    Castle_Age = TechnologyResearchTimes.get("Castle_Age", "")
-    Feudal_Age = TechnologyResearchTimes.get("Feudal_Age", "")
-    Imperial_Age = TechnologyResearchTimes.get("Imperial_Age", "")
-    Loom = TechnologyResearchTimes.get("Loom", "")
-    Town_Watch = TechnologyResearchTimes.get("Town_Watch", "")
-    Town_Patrol = TechnologyResearchTimes.get("Town_Patrol", "")
-    Wheelbarrow = TechnologyResearchTimes.get("Wheelbarrow", "")
-    Hand_Cart = TechnologyResearchTimes.get("Hand_Cart", "")
+    Castle_Age = TechnologyResearchTimes.Castle_Age.value
+    Feudal_Age = TechnologyResearchTimes.Feudal_Age.value
+    Imperial_Age = TechnologyResearchTimes.Imperial_Age.value
+    Loom = TechnologyResearchTimes.Loom.value
+    Town_Watch = TechnologyResearchTimes.Town_Watch.value
+    Town_Patrol = TechnologyResearchTimes.Town_Patrol.value
+    Wheelbarrow = TechnologyResearchTimes.Wheelbarrow.value
+    Hand_Cart = TechnologyResearchTimes.Hand_Cart.value
 
     # actual units below
     Arbalest = 27
@@ -587,8 +686,8 @@ class UnitCreationTime(Enum):
                 # In this case error as MGZ has incorrectly read in a technology or there is a bug in AgeAlyser
                 raise ValueError(f"A unit has been incorrectly parsed by MGZ or there is a bug in AgeAlyser. Please Raise an issue with details on the game (unit: {name})")
             else:
-                # In this case I have not updated the AgeAlyser Enums - raise a warning for the user to raise an issue but do not fail
-                warnings.warn(f"A unit could not be found in the game data. Please raise an issue on github (unit: {name})")
+                # In this case I have not updated the AgeAlyser Enums - tell the user to raise an issue but do not fail
+                record("unknown_unit", name)  # Counted and reported once per game, see diagnostics
             return False
         else:
             return True
@@ -686,6 +785,66 @@ class UnitCreationTime(Enum):
                 return cls[name].value
 
 
+def known_civilisations() -> List[str]:
+    """Every civilisation in mgz's reference data for DE, named as mgz names the players' civilisations"""
+    _, dataset = get_dataset(Version.DE, None)
+    return sorted({civilisation["name"] for civilisation in dataset["civilizations"].values()})
+
+
+class TimingTable:
+    """Precomputed (civilisation x item) table of the times in one of the timing Enums, built once at import.
+
+    The civilisation overrides in the Enum get methods are evaluated up front for every item, so that the analysis can look
+    up many times at once with a single array index rather than a match statement and Enum lookup per row.
+    The civilisations with overrides are found by evaluating get for every civilisation, so the table cannot drift from
+    the get method - civilisations without any overrides use the default row.
+
+    :param enum: BuildTimesEnum, TechnologyResearchTimes or UnitCreationTime
+    :param civilisations: civilisations to evaluate get for, defaults to every civilisation (see known_civilisations)
+    """
+
+    def __init__(self, enum: type[Enum], civilisations: Iterable[str] | None = None) -> None:
+        self.enum = enum
+        # __members__ rather than iterating the Enum, which skips aliases (i.e. every item with the same time as an earlier one)
+        self.items: List[str] = [
+            name for name, member in enum.__members__.items() if not isinstance(member.value, dict)  # Skip OVERRIDES
+        ]
+        self.item_index: Dict[str, int] = {item: index for index, item in enumerate(self.items)}
+
+        # Row 0 is the default for civilisations without overrides
+        default_times = [enum.get(item, civilisation="") for item in self.items]
+        rows = [default_times]
+        self.civilisation_index: Dict[str, int] = {}
+        for civilisation in civilisations if civilisations is not None else known_civilisations():
+            civilisation_times = [enum.get(item, civilisation=civilisation) for item in self.items]
+            if civilisation_times != default_times:
+                self.civilisation_index[civilisation] = len(rows)
+                rows.append(civilisation_times)
+        self.times = np.array(rows, dtype=np.float64)
+
+    def has_value(self, name: str) -> bool:
+        """Whether the item is in the table. Unknown items are passed to the Enum's has_value, which records or raises"""
+        if name in self.item_index:
+            return True
+        return self.enum.has_value(name)
+
+    def get(self, name: str, civilisation: str | None) -> float:
+        """Time for one item, in seconds"""
+        return self.times[self.civilisation_index.get(civilisation, 0), self.item_index[name]]
+
+    def lookup(self, names: Iterable[str], civilisation: str | None) -> np.ndarray:
+        """Times for many items at once, in seconds. Items that are not in the table are NaN"""
+        indices = np.array([self.item_index.get(name, -1) for name in names], dtype=np.intp)
+        times = self.times[self.civilisation_index.get(civilisation, 0)].take(indices)  # -1 takes the last item...
+        times[indices == -1] = np.nan  # ... so mark unknown items afterwards
+        return times
+
+
+BUILD_TIMES: Final[TimingTable] = TimingTable(BuildTimesEnum)
+RESEARCH_TIMES: Final[TimingTable] = TimingTable(TechnologyResearchTimes)
+UNIT_CREATION_TIMES: Final[TimingTable] = TimingTable(UnitCreationTime)
+
+
 class Civilisations(Enum):
     """TODO assign and ID to validate strings and create automated testing + exceptions"""
 
@@ -0,0 +1,222 @@
+"""Batch analysis of many recorded games. Fans games out across a process pool so a corpus of replays
+is not bound to a single core, and keeps going past games that this package or MGZ cannot handle.
+"""
+
+import logging
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Iterable, Iterator, List, Tuple
+
+import pandas as pd
+
+from .cache import ReplayCache
+from .instrumentation import Instrumentation
+from .main import AgeGame
+from .utils import MGZParserException, AgeAlyserAnalysisError
+
+logger = logging.getLogger(__name__)
+
+FAILURE_COLUMNS: List[str] = ["path", "error", "message"]
+
+
+def analyse_game(
+    path: Path | str,
+    include_map_analyses: bool = True,
+    cache: ReplayCache | None = None,
+    sections: Iterable[str] | None = None,
+) -> Tuple[str, pd.Series | None, dict | None]:
+    """Run the advanced parser on a single game, catching the errors that mean this game should be skipped.
+
+    :param path: path to the .aoe2record file
+    :param include_map_analyses: passed through to AgeGame.advanced_parser
+    :param cache: optional on-disk cache of parsed games, passed through to AgeGame
+    :param sections: sections of the analysis to run, passed through to AgeGame.advanced_parser. Defaults to all of them
+    :return: tuple of (path, results or None, failure record or None)
+    """
+    try:
+        results = AgeGame(path, cache=cache).advanced_parser(
+            include_map_analyses=include_map_analyses, sections=sections
+        )
+    except (MGZParserException, AgeAlyserAnalysisError) as e:
+        # Expected failure states for mass analysis - record them and move onto the next game. Anything else is a bug.
+        logger.warning(f"Skipping game {path}: {e.message}")
+        return str(path), None, {"path": str(path), "error": type(e).__name__, "message": e.message}
+    return str(path), results, None
+
+
+def _analyse_game_with_records(
+    path: Path | str,
+    include_map_analyses: bool = True,
+    cache: ReplayCache | None = None,
+    sections: Iterable[str] | None = None,
+    trace_memory: bool | None = None,
+) -> Tuple[Tuple[str, pd.Series | None, dict | None], List[dict]]:
+    """analyse_game, also returning the instrumentation records of the game if trace_memory is not None. Spans are
+    collected per process, so the records of games analysed in worker processes are sent back with their results"""
+    if trace_memory is None:
+        return analyse_game(path, include_map_analyses, cache, sections), []
+    with Instrumentation(trace_memory=trace_memory) as instrumentation:
+        with instrumentation.span("game", replay=str(path)):
+            outcome = analyse_game(path, include_map_analyses, cache, sections)
+    return outcome, instrumentation.records
+
+
+def iter_results(
+    paths: Iterable[Path | str],
+    workers: int | None = None,
+    include_map_analyses: bool = True,
+    cache: ReplayCache | None = None,
+    sections: Iterable[str] | None = None,
+    max_pending: int | None = None,
+    instrumentation: Instrumentation | None = None,
+) -> Iterator[Tuple[str, pd.Series | None, dict | None]]:
+    """Analyse games one at a time, yielding each game's results as soon as they are ready (in the order of paths).
+    Only a few games are in flight at once and nothing is kept once yielded, so memory does not grow with the number
+    of games - paths can be a lazy iterable over a corpus of any size.
+
+    :param paths: paths to .aoe2record files
+    :param workers: number of worker processes, defaults to the number of CPUs. 1 runs in this process (useful for debugging)
+    :param include_map_analyses: passed through to AgeGame.advanced_parser
+    :param cache: optional on-disk cache of parsed games shared by the workers
+    :param sections: sections of the analysis to run, passed through to AgeGame.advanced_parser. Defaults to all of them
+    :param max_pending: maximum number of games submitted to the workers and not yet yielded, defaults to 4 per worker
+    :param instrumentation: optional Instrumentation to collect the spans of every game into, including those analysed in
+        worker processes. Its trace_memory setting is used in the workers
+    :return: iterator of (path, results or None, failure record or None) - see analyse_game
+    """
+    workers = workers if workers is not None else os.cpu_count()
+    sections = tuple(sections) if sections is not None else None
+    trace_memory = instrumentation.trace_memory if instrumentation is not None else None
+
+    def collect(outcome_and_records: Tuple[Tuple[str, pd.Series | None, dict | None], List[dict]]):
+        outcome, records = outcome_and_records
+        if instrumentation is not None:
+            instrumentation.add_records(records)
+        return outcome
+
+    if workers == 1:
+        for path in paths:
+            yield collect(_analyse_game_with_records(str(path), include_map_analyses, cache, sections, trace_memory))
+        return
+
+    max_pending = max_pending if max_pending is not None else workers * 4
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        pending = deque()
+        for path in paths:
+            pending.append(
+                executor.submit(
+                    _analyse_game_with_records, str(path), include_map_analyses, cache, sections, trace_memory
+                )
+            )
+            if len(pending) >= max_pending:
+                yield collect(pending.popleft().result())
+        while pending:
+            yield collect(pending.popleft().result())
+
+
+def write_results(
+    paths: Iterable[Path | str], directory: Path | str, batch_size: int = 1000, **kwargs
+) -> pd.DataFrame:
+    """Analyse games and write the results to Parquet in batches as they are produced, so that a corpus of any size
+    can be analysed without holding all of the results in memory. Requires pyarrow.
+
+    Each batch is written to its own file, results-00000.parquet, results-00001.parquet, etc. in directory. As in the
+    CLI, values are stored as strings since each column may mix Timedeltas, None and str.
+
+    :param paths: paths to .aoe2record files
+    :param directory: directory to write the results to, created if it does not exist
+    :param batch_size: number of games per Parquet file
+    :param kwargs: passed through to iter_results
+    :return: the games that could not be analysed, one row per game
+    :rtype: pd.DataFrame
+    """
+    directory = Path(directory)
+    directory.mkdir(parents=True, exist_ok=True)
+
+    batch = []
+    failures = []
+    number_of_batches = 0
+
+    def flush() -> None:
+        nonlocal batch, number_of_batches
+        results = pd.DataFrame(batch)
+        results.index.name = "path"
+        results.astype(str).to_parquet(directory / f"results-{number_of_batches:05d}.parquet")
+        logger.info(f"Wrote batch {number_of_batches} of {len(batch)} games to {directory}")
+        batch = []
+        number_of_batches += 1
+
+    for path, result, failure in iter_results(paths, **kwargs):
+        if failure is not None:
+            failures.append(failure)
+            continue
+        batch.append(result.rename(path))
+        if len(batch) >= batch_size:
+            flush()
+    if batch:
+        flush()
+
+    return pd.DataFrame(failures, columns=FAILURE_COLUMNS)
+
+
+def analyse_many(
+    paths: Iterable[Path | str],
+    workers: int | None = None,
+    include_map_analyses: bool = True,
+    chunksize: int = 1,
+    cache: ReplayCache | None = None,
+    sections: Iterable[str] | None = None,
+    instrumentation: Instrumentation | None = None,
+) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    """Analyse many games in parallel. Each game is parsed and analysed in its own worker process.
+    All of the results are held in memory - for large corpora use iter_results or write_results.
+
+    :param paths: paths to .aoe2record files
+    :param workers: number of worker processes, defaults to the number of CPUs. 1 runs in this process (useful for debugging)
+    :param include_map_analyses: passed through to AgeGame.advanced_parser
+    :param chunksize: number of games sent to a worker at a time, raise for large corpora of small games
+    :param cache: optional on-disk cache of parsed games shared by the workers
+    :param sections: sections of the analysis to run, passed through to AgeGame.advanced_parser. Defaults to all of them
+    :param instrumentation: optional Instrumentation to collect the spans of every game into, including those analysed in
+        worker processes - see iter_results
+    :return: tuple of (results, failures). Results has one row per game indexed by path, failures has a row per skipped game
+    :rtype: Tuple[pd.DataFrame, pd.DataFrame]
+    """
+    paths = [str(path) for path in paths]
+    workers = workers if workers is not None else os.cpu_count()
+    trace_memory = instrumentation.trace_memory if instrumentation is not None else None
+
+    if workers == 1 or len(paths) <= 1:
+        outcomes_and_records = [
+            _analyse_game_with_records(path, include_map_analyses, cache, sections, trace_memory) for path in paths
+        ]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            outcomes_and_records = list(
+                executor.map(
+                    _analyse_game_with_records,
+                    paths,
+                    [include_map_analyses] * len(paths),
+                    [cache] * len(paths),
+                    [sections] * len(paths),
+                    [trace_memory] * len(paths),
+                    chunksize=chunksize,
+                )
+            )
+    outcomes = [outcome for outcome, _ in outcomes_and_records]
+    if instrumentation is not None:
+        for _, records in outcomes_and_records:
+            instrumentation.add_records(records)
+
+    results = pd.DataFrame(
+        [result.rename(path) for path, result, _ in outcomes if result is not None]
+    )
+    results.index.name = "path"
+    failures = pd.DataFrame(
+        [failure for _, _, failure in outcomes if failure is not None], columns=FAILURE_COLUMNS
+    )
+    logger.info(f"Analysed {len(results)} games, {len(failures)} failed")
+
+    return results, failures
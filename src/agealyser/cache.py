@@ -0,0 +1,141 @@
+"""Opt-in on-disk cache of parsed games. Parsing a game with mgz is expensive and does not change when the
+analysis in this package is tweaked, so the normalised data is stored as Parquet files and re-used.
+
+Entries are keyed by a hash of the replay bytes, the mgz version, the AgeAlyser version and the format of the cached
+tables - upgrading either package or changing the tables invalidates the cache. The cache is bounded in size and evicts
+the least recently used games first.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import shutil
+from importlib import metadata as importlib_metadata
+from pathlib import Path
+from typing import Dict, Tuple
+
+import numpy as np
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+CACHED_TABLES = ["inputs", "actions", "map_tiles", "gaia"]
+# Bump whenever the schema of the cached tables changes (columns, dtypes, etc.) - the package version is not bumped for
+# every change, so without this an existing cache would serve frames in the old format
+CACHE_FORMAT_VERSION = 1
+
+
+def package_version(name: str) -> str:
+    try:
+        return importlib_metadata.version(name)
+    except importlib_metadata.PackageNotFoundError:
+        return "unknown"
+
+
+class ReplayCache:
+    """Size-bounded LRU cache of parsed games on disk. Each game is a directory holding a Parquet file per table
+    and a JSON file of the game and player metadata. Requires pyarrow.
+
+    :param directory: directory for the cache, created if it does not exist
+    :param max_size_bytes: evict least recently used games once the cache grows past this size, defaults to 2GB
+    """
+
+    def __init__(self, directory: Path | str, max_size_bytes: int = 2 * 1024**3) -> None:
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.max_size_bytes = max_size_bytes
+        self.versions = (
+            f"mgz={package_version('mgz')};age-alyser={package_version('age-alyser')};format={CACHE_FORMAT_VERSION}"
+        )
+
+    def key(self, replay_bytes: bytes) -> str:
+        """Key for a game - changes if the game, the version of mgz or AgeAlyser or the format of the cache changes"""
+        hasher = hashlib.sha256(replay_bytes)
+        hasher.update(self.versions.encode("utf-8"))
+        return hasher.hexdigest()
+
+    def load(self, key: str) -> Tuple[dict, Dict[str, pd.DataFrame]] | None:
+        """Load a game from the cache. Returns None on a cache miss (or an unreadable entry)"""
+        entry = self.directory / key
+        if not (entry / "metadata.json").exists():
+            return None
+
+        try:
+            with open(entry / "metadata.json", "r", encoding="utf-8") as f:
+                game_metadata = json.load(f)
+            tables = {table: pd.read_parquet(entry / f"{table}.parquet") for table in CACHED_TABLES}
+        except (OSError, ValueError) as e:
+            logger.warning(f"Could not read cached game {key}, it will be parsed again: {e}")
+            shutil.rmtree(entry, ignore_errors=True)
+            return None
+
+        for table in tables.values():
+            self.restore_list_columns(table)
+
+        os.utime(entry)  # Mark as recently used for the LRU eviction
+        return game_metadata, tables
+
+    def store(self, key: str, game_metadata: dict, tables: Dict[str, pd.DataFrame]) -> None:
+        """Write a game to the cache then evict old games if the cache is too large. The cache is only an optimisation -
+        if the game cannot be written (e.g. pyarrow is not installed or the directory is read only) this is logged and
+        the analysis carries on uncached"""
+        entry = self.directory / key
+        partial_entry = self.directory / f"{key}.{os.getpid()}.partial"  # Unique per process - workers can share a cache
+
+        try:
+            partial_entry.mkdir(exist_ok=True)
+            for table in CACHED_TABLES:
+                tables[table].to_parquet(partial_entry / f"{table}.parquet")
+            # Metadata is written last - an entry is only valid once this file exists
+            with open(partial_entry / "metadata.json", "w", encoding="utf-8") as f:
+                json.dump(game_metadata, f)
+        except Exception as e:  # Any failure to write (missing pyarrow, OSError, ArrowException...) leaves the game uncached
+            logger.warning(f"Could not cache game {key}, carrying on without the cache: {e}")
+            shutil.rmtree(partial_entry, ignore_errors=True)
+            return
+
+        shutil.rmtree(entry, ignore_errors=True)
+        try:
+            partial_entry.rename(entry)
+        except OSError:
+            # Another process stored this game at the same time - keep theirs
+            shutil.rmtree(partial_entry, ignore_errors=True)
+        self.evict()
+
+    def size_of_entry(self, entry: Path) -> int:
+        return sum(file.stat().st_size for file in entry.iterdir())
+
+    def evict(self) -> None:
+        """Remove the least recently used games until the cache is within its maximum size"""
+        entries = {}
+        for entry in self.directory.iterdir():
+            if not entry.is_dir() or entry.name.endswith(".partial"):
+                continue
+            try:
+                entries[entry] = (entry.stat().st_mtime, self.size_of_entry(entry))
+            except FileNotFoundError:
+                continue  # Evicted by another process
+        total_size = sum(size for _, size in entries.values())
+
+        for entry in sorted(entries, key=lambda e: entries[e][0]):
+            if total_size <= self.max_size_bytes:
+                break
+            logger.info(f"Evicting cached game {entry.name}")
+            shutil.rmtree(entry, ignore_errors=True)
+            total_size -= entries[entry][1]
+
+    def clear(self) -> None:
+        """Remove every game from the cache"""
+        for entry in self.directory.iterdir():
+            if entry.is_dir():
+                shutil.rmtree(entry, ignore_errors=True)
+
+    @staticmethod
+    def restore_list_columns(df: pd.DataFrame) -> None:
+        """Parquet gives back list columns (e.g. payload.object_ids) as numpy arrays - convert back to lists in place,
+        as the analysis compares and groups these values"""
+        for column in df.columns[df.dtypes == object]:
+            first_value = df[column].dropna().head(1)
+            if not first_value.empty and isinstance(first_value.iloc[0], np.ndarray):
+                df[column] = df[column].map(lambda x: x.tolist() if isinstance(x, np.ndarray) else x)
@@ -0,0 +1,107 @@
+"""Command line entry point for analysing a batch of recorded games"""
+
+import argparse
+import logging
+from pathlib import Path
+from typing import List
+
+import pandas as pd
+
+from .batch import analyse_many, write_results
+from .cache import ReplayCache
+from .main import ANALYSIS_SECTIONS
+
+
+def collect_replays(paths: List[str]) -> List[Path]:
+    """Expand any directories passed on the command line into the .aoe2record files within them"""
+    replays = []
+    for path in map(Path, paths):
+        if path.is_dir():
+            replays.extend(sorted(path.rglob("*.aoe2record")))
+        else:
+            replays.append(path)
+    return replays
+
+
+def write_table(df: pd.DataFrame, path: Path) -> None:
+    """Write a table to csv or parquet depending on the file extension"""
+    if path.suffix == ".parquet":
+        # Parquet needs consistent types in each column - mixed Timedeltas/None/str in object columns are stored as str
+        df.astype(str).to_parquet(path)
+    else:
+        df.to_csv(path)
+
+
+def main(argv: List[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(
+        prog="agealyser", description="Run the AgeAlyser advanced parser over many recorded games"
+    )
+    parser.add_argument("paths", nargs="+", help=".aoe2record files or directories containing them")
+    parser.add_argument("-w", "--workers", type=int, default=None, help="number of worker processes (default: all CPUs)")
+    parser.add_argument(
+        "-o",
+        "--output",
+        type=Path,
+        default=None,
+        help="results file (.csv or .parquet, default: agealyser_results.csv), or with --batch-size a directory "
+        "(default: agealyser_results/)",
+    )
+    parser.add_argument("--failures", type=Path, default=Path("agealyser_failures.csv"), help="file for games that could not be analysed")
+    parser.add_argument("--no-map", action="store_true", help="skip the analysis of the map")
+    parser.add_argument(
+        "--sections", nargs="+", choices=ANALYSIS_SECTIONS, default=None, help="sections of the analysis to run (default: all)"
+    )
+    parser.add_argument(
+        "--batch-size",
+        type=int,
+        default=None,
+        help="stream results to Parquet files of this many games in the --output directory, rather than one table in memory",
+    )
+    parser.add_argument("--chunksize", type=int, default=1, help="number of games sent to each worker at a time")
+    parser.add_argument("--cache-dir", type=Path, default=None, help="directory to cache parsed games in (requires pyarrow)")
+    parser.add_argument("--cache-size-mb", type=int, default=2048, help="maximum size of the cache of parsed games")
+    args = parser.parse_args(argv)
+    if args.batch_size is not None:
+        # Batches are written as results-NNNNN.parquet files, so --output is a directory rather than a results file
+        if args.output is None:
+            args.output = Path("agealyser_results")
+        elif args.output.suffix in (".csv", ".parquet") or args.output.is_file():
+            parser.error(f"--batch-size writes a directory of Parquet files - pass a directory to --output, not {args.output}")
+    elif args.output is None:
+        args.output = Path("agealyser_results.csv")
+
+    logging.basicConfig(level=logging.WARNING)
+
+    replays = collect_replays(args.paths)
+    cache = ReplayCache(args.cache_dir, max_size_bytes=args.cache_size_mb * 1024**2) if args.cache_dir else None
+    if args.batch_size is not None:
+        failures = write_results(
+            replays,
+            args.output,
+            batch_size=args.batch_size,
+            workers=args.workers,
+            include_map_analyses=not args.no_map,
+            cache=cache,
+            sections=args.sections,
+        )
+        failures.to_csv(args.failures, index=False)
+        print(f"Analysed {len(replays) - len(failures)} of {len(replays)} games. {len(failures)} failed - see {args.failures}")
+        return 0
+
+    results, failures = analyse_many(
+        replays,
+        workers=args.workers,
+        include_map_analyses=not args.no_map,
+        chunksize=args.chunksize,
+        cache=cache,
+        sections=args.sections,
+    )
+
+    write_table(results, args.output)
+    failures.to_csv(args.failures, index=False)
+    print(f"Analysed {len(results)} of {len(replays)} games. {len(failures)} failed - see {args.failures}")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
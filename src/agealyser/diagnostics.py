@@ -0,0 +1,80 @@
+"""Aggregated diagnostics of the data issues found while analysing a game. Rather than logging or warning on every row
+(which is slow and floods the logs on replays from new patches, where many units and technologies are unknown),
+issues are counted per game and reported once as a summary:
+
+    with Diagnostics() as diagnostics:
+        ...  # analysis that calls record("unknown_unit", name) - name is anything hashable, formatted only in the summary
+    diagnostics.log_summary(game="file/path/to/game.aoe2record")
+
+AgeGame collects the diagnostics of its analysis in AgeGame.diagnostics. Without an active Diagnostics, record only logs
+at debug level - no message is formatted unless debug logging is turned on.
+"""
+
+import logging
+from collections import Counter
+from contextvars import ContextVar
+from typing import Hashable
+
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+# Kinds of issue that mean AgeAlyser's Enums are out of date with the game - the user should raise an issue
+UNKNOWN_KINDS = ("unknown_building", "unknown_technology", "unknown_unit")
+
+_active_diagnostics: ContextVar["Diagnostics | None"] = ContextVar("active_diagnostics", default=None)
+
+
+class Diagnostics:
+    """Counts each kind of issue and the name it was found for (e.g. the unit) while it is active (i.e. within its
+    with block). Can be entered more than once, e.g. for each stage of the analysis of the same game.
+    """
+
+    def __init__(self) -> None:
+        self.counts: Counter = Counter()
+        self._tokens = []
+
+    def __enter__(self) -> "Diagnostics":
+        self._tokens.append(_active_diagnostics.set(self))
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        _active_diagnostics.reset(self._tokens.pop())
+
+    def record(self, kind: str, name: Hashable) -> None:
+        self.counts[(kind, name)] += 1
+
+    def to_dataframe(self) -> pd.DataFrame:
+        """One row per kind of issue and name, with the number of times it was found"""
+        return pd.DataFrame(
+            [(kind, name, count) for (kind, name), count in self.counts.items()], columns=["kind", "name", "count"]
+        )
+
+    def summary(self) -> str:
+        """Human readable summary, e.g. 'unknown_unit: Fire Lancer (3), Rocketry Cart (1); building_not_built: Mill (1)'"""
+        names_by_kind = {}
+        for (kind, name), count in self.counts.most_common():
+            names_by_kind.setdefault(kind, []).append(f"{name} ({count})")
+        return "; ".join(f"{kind}: {', '.join(names)}" for kind, names in names_by_kind.items())
+
+    def log_summary(self, game: str) -> None:
+        """Log a single summary of the issues found in a game. Warns if any items were missing from the Enums"""
+        if not self.counts:
+            return
+        if any(kind in UNKNOWN_KINDS for kind, _ in self.counts):
+            logger.warning(
+                "Items that could not be found in the game data were skipped in %s. Please raise an issue on github. %s",
+                game,
+                self.summary(),
+            )
+        elif logger.isEnabledFor(logging.INFO):
+            logger.info("Issues found analysing %s: %s", game, self.summary())
+
+
+def record(kind: str, name: Hashable) -> None:
+    """Count an issue in the active Diagnostics. Without one, it is only logged at debug level"""
+    diagnostics = _active_diagnostics.get()
+    if diagnostics is None:
+        logger.debug("%s: %s", kind, name)
+        return
+    diagnostics.record(kind, name)
@@ -0,0 +1,322 @@
+"""Adapters from the mgz model to pandas. Walks the parsed mgz Match once and builds typed, columnar DataFrames
+directly, rather than serialising the whole match to JSON and flattening it again with pd.json_normalize.
+Column names follow the json_normalize convention (e.g. "payload.object_ids", "position.x") used throughout the package.
+"""
+
+import struct
+from datetime import timedelta
+from enum import Enum
+from typing import BinaryIO, Dict, List, Tuple
+
+import numpy as np
+import pandas as pd
+from mgz import fast
+from mgz.common.map import get_map_data, lookup_name
+from mgz.fast.header import decompress, parse, parse_de, parse_map, parse_metadata, parse_version
+from mgz.model import get_map_id, serialize
+from mgz.reference import get_dataset
+
+
+def timedelta_to_ns(value: timedelta) -> int:
+    """Exact integer nanoseconds of a datetime.timedelta (avoids float rounding of total_seconds)"""
+    return ((value.days * 86400 + value.seconds) * 1_000_000 + value.microseconds) * 1000
+
+
+def _payload_value(value):
+    """Mirror mgz serialize for the payload values - Enums to their name, bytes are dropped"""
+    if isinstance(value, Enum):
+        return value.name
+    if isinstance(value, bytes):
+        return None
+    return value
+
+
+def events_to_dataframe(events: list) -> pd.DataFrame:
+    """Build a DataFrame of mgz Inputs or Actions in a single pass over the events.
+
+    :param events: list of mgz.model Input or Action objects
+    :return: DataFrame with timestamp (timedelta64[ns]), type and param (Inputs only) as categoricals, player, position
+        and payload columns
+    :rtype: pd.DataFrame
+    """
+    number_of_events = len(events)
+    has_param = number_of_events > 0 and hasattr(events[0], "param")
+
+    timestamps = np.empty(number_of_events, dtype=np.int64)
+    types: List[str | None] = [None] * number_of_events
+    params: List[str | None] = [None] * number_of_events
+    players = np.full(number_of_events, np.nan)
+    position_x = np.full(number_of_events, np.nan)
+    position_y = np.full(number_of_events, np.nan)
+    payload: dict = {}  # payload key -> column, created on first appearance of the key
+
+    for index, event in enumerate(events):
+        timestamps[index] = timedelta_to_ns(event.timestamp)
+        types[index] = event.type.name if isinstance(event.type, Enum) else event.type
+        if has_param:
+            params[index] = event.param
+        if event.player is not None:
+            players[index] = event.player.number
+        if event.position is not None:
+            # mgz can create positions with no coordinates
+            if event.position.x is not None:
+                position_x[index] = event.position.x
+            if event.position.y is not None:
+                position_y[index] = event.position.y
+        for key, value in event.payload.items():
+            value = _payload_value(value)
+            if value is None:
+                continue
+            column = payload.get(key)
+            if column is None:
+                column = payload[key] = [None] * number_of_events
+            column[index] = value
+
+    # type and param are categorical - a game has a few hundred distinct values across many thousands of events, so the
+    # analysis' filters on these columns compare integer codes rather than strings (and the frames are much smaller)
+    columns = {
+        "timestamp": pd.Series(timestamps.view("timedelta64[ns]")),
+        "type": pd.Series(types, dtype="category"),
+    }
+    if has_param:
+        columns["param"] = pd.Series(params, dtype="category")
+    columns["player"] = pd.Series(players)
+    columns["position.x"] = pd.Series(position_x)
+    columns["position.y"] = pd.Series(position_y)
+    for key, values in payload.items():
+        # Let pandas infer - numbers become float64 with NaN for missing, strings and lists stay as objects
+        columns[f"payload.{key}"] = pd.Series(values)
+
+    return pd.DataFrame(columns)
+
+
+def intern_object_ids(object_ids: pd.Series) -> pd.Series:
+    """Intern the lists of object IDs (e.g. the villagers given a command) to integer keys - equal lists get the same key,
+    so rows can be compared with numeric operations rather than comparing lists. Missing values are -1.
+
+    :param object_ids: payload.object_ids column
+    :return: int64 keys, with the index of object_ids
+    :rtype: pd.Series
+    """
+    keys: dict = {}
+    interned = np.fromiter(
+        (
+            keys.setdefault(tuple(ids), len(keys)) if isinstance(ids, (list, tuple, np.ndarray)) else -1
+            for ids in object_ids
+        ),
+        dtype=np.int64,
+        count=len(object_ids),
+    )
+    return pd.Series(interned, index=object_ids.index)
+
+
+def inputs_to_dataframe(inputs: list) -> pd.DataFrame:
+    """DataFrame of the player inputs (mgz.model Input) of a match, with the object IDs interned to object_ids_key"""
+    inputs_df = events_to_dataframe(inputs)
+    if "payload.object_ids" in inputs_df.columns:
+        inputs_df["object_ids_key"] = intern_object_ids(inputs_df["payload.object_ids"])
+    return inputs_df
+
+
+def actions_to_dataframe(actions: list) -> pd.DataFrame:
+    """DataFrame of the raw actions (mgz.model Action) of a match"""
+    return events_to_dataframe(actions)
+
+
+def map_tiles_to_dataframe(tiles: list) -> pd.DataFrame:
+    """DataFrame of the terrain tiles (mgz.model Tile) of a map, with the position split into x and y"""
+    return pd.DataFrame(
+        {
+            "terrain": [tile.terrain for tile in tiles],
+            "elevation": [tile.elevation for tile in tiles],
+            "x": [tile.position.x for tile in tiles],
+            "y": [tile.position.y for tile in tiles],
+        }
+    )
+
+
+def objects_to_dataframe(objects: list) -> pd.DataFrame:
+    """DataFrame of map objects (mgz.model Object), e.g. the gaia objects, with the position split into x and y"""
+    return pd.DataFrame(
+        {
+            "name": pd.Series([obj.name for obj in objects], dtype=object),
+            "class_id": [obj.class_id for obj in objects],
+            "object_id": [obj.object_id for obj in objects],
+            "instance_id": [obj.instance_id for obj in objects],
+            "index": [obj.index for obj in objects],
+            "x": [obj.position.x for obj in objects],
+            "y": [obj.position.y for obj in objects],
+        }
+    )
+
+
+def match_to_tables(match) -> Tuple[dict, Dict[str, pd.DataFrame]]:
+    """Extract everything AgeAlyser uses from a parsed mgz Match.
+
+    :param match: mgz.model Match
+    :return: tuple of (metadata, tables). Metadata is a JSON friendly dict of the game and player information,
+        tables holds the "inputs", "actions", "map_tiles" and "gaia" DataFrames
+    :rtype: Tuple[dict, Dict[str, pd.DataFrame]]
+    """
+    map_info = {
+        field: getattr(match.map, field)
+        for field in ["id", "name", "dimension", "size", "custom", "seed", "zr", "modes"]
+    }
+    metadata = {
+        "teams": [[player.number for player in team] for team in match.teams],
+        "rated": match.rated,
+        "speed": match.speed,
+        "dataset": match.dataset,
+        "starting_age": match.starting_age,
+        "duration": str(match.duration),
+        "timestamp": str(match.timestamp) if match.timestamp else None,
+        "players": serialize(match.players),  # small - list of dicts with civilisations, locations, elo, etc.
+        "map": map_info,
+    }
+    tables = {
+        "inputs": inputs_to_dataframe(match.inputs),
+        "actions": actions_to_dataframe(match.actions),
+        "map_tiles": map_tiles_to_dataframe(match.map.tiles),
+        "gaia": objects_to_dataframe(match.gaia),
+    }
+    return metadata, tables
+
+
+# The quick summary below is built on mgz.fast (the header sections and the operation layout of the body), which is not
+# part of mgz's public API - mgz's own Summary does a full parse of DE games. The supported range of mgz is pinned in
+# pyproject.toml, and the tests check the summary against mgz.model.parse_match for every bundled replay
+ACTION_OPERATION = struct.pack("<I", fast.Operation.ACTION.value)
+SYNC_OPERATION = struct.pack("<I", fast.Operation.SYNC.value)
+SYNC_PLAYER_VALUES = fast.MAX_PLAYERS * fast.SYNC_LEN_PER_PLAYER
+CUSTOM_MAP_IDS = [59, 137, 138]  # Map IDs of custom maps - the name is only found in the scenario instructions
+
+
+def skip_sync(handle: BinaryIO) -> int:
+    """Skip over a sync operation (the op ID has already been read), following the layout in mgz.fast.sync
+    without unpacking the per player statistics.
+
+    :return: the time increment of the sync, in ms
+    """
+    increment, marker = struct.unpack("<II", handle.read(8))
+    if marker:
+        handle.seek(-4, 1)
+        return increment
+    _, is_de = struct.unpack("<4xI4xI", handle.read(16))
+    if not is_de:
+        handle.read(8)
+        return increment
+    handle.seek(-16, 1)
+    handle.read(4 * SYNC_PLAYER_VALUES + 4)  # Per player values, then the current time
+    return increment
+
+
+def scan_body(handle: BinaryIO) -> Tuple[int, set, dict]:
+    """Scan the body of a recorded game for the few things the summary needs - the length of the game, who resigned and the
+    ratings in the postgame block. Syncs and actions (nearly all of the body) are skipped over without being decoded,
+    everything else is left to mgz.fast.
+
+    :param handle: replay positioned at the start of the body (i.e. after mgz.fast.header.parse)
+    :return: tuple of (duration in ms, player numbers that resigned, player number -> rating)
+    :rtype: Tuple[int, set, dict]
+    """
+    fast.meta(handle)
+    timestamp = 0
+    resigned = set()
+    ratings = {}
+    while True:
+        try:
+            op_id = handle.read(4)
+            if op_id == SYNC_OPERATION:
+                timestamp += skip_sync(handle)
+                continue
+            if op_id == ACTION_OPERATION:
+                length, action_id = struct.unpack("<IB", handle.read(5))
+                action_bytes = handle.read(length - 1)
+                if action_id == fast.Action.POSTGAME.value:
+                    break  # Takes up the rest of the file
+                if action_id == fast.Action.RESIGN.value:
+                    resigned.add(action_bytes[0])
+                handle.read(4)  # sequence
+                continue
+
+            handle.seek(-len(op_id), 1)
+            op_type, op_data = fast.operation(handle)
+            if op_type is fast.Operation.POSTGAME and "leaderboards" in op_data:
+                # Leaderboard player numbers are zero-indexed
+                ratings = {x["number"] + 1: x["rating"] for x in op_data["leaderboards"][0]["players"]}
+        except (EOFError, struct.error, IndexError):
+            break
+    return timestamp, resigned, ratings
+
+
+def replay_summary(handle: BinaryIO) -> dict:
+    """Summarise a recorded game from its header, without building the full mgz model of the match.
+    Mirrors how mgz.model.parse_match reads these values, so they agree with a full parse.
+
+    For DE games on built in maps only the DE section of the header is read - everything needed is there, and the rest
+    of the header (the starting objects of every player) is by far the slowest part to parse.
+
+    :param handle: the replay, opened in binary mode
+    :return: JSON friendly dict with the map name, duration, whether the game was rated and the players
+    :rtype: dict
+    """
+    start_of_file = handle.tell()
+    header = decompress(handle)
+    version, _, save, _ = parse_version(header, handle)
+    de = parse_de(header, version, save)
+
+    if de is not None and de["rms_map_id"] not in CUSTOM_MAP_IDS:
+        parse_metadata(header, save)
+        restore_time = parse_map(header, version, save)["restore_time"]  # Non zero if the game was restored from a save
+        dataset_id, dataset = get_dataset(version, de["dlc_ids"])
+        map_name, _ = lookup_name(de["rms_map_id"], None, version, dataset)
+        encoding = "utf-8"
+        raw_players = de["players"]
+    else:
+        handle.seek(start_of_file)
+        data = parse(handle)
+        dataset_id, dataset = get_dataset(data["version"], data["mod"])
+        map_data, encoding, _ = get_map_data(
+            get_map_id(data),
+            data["scenario"]["instructions"],
+            data["map"]["dimension"],
+            data["version"],
+            dataset_id,
+            dataset,
+            data["map"]["tiles"],
+            de_seed=data["lobby"]["seed"],
+        )
+        map_name = map_data["name"]
+        de_players = {player["number"]: player for player in data["de"]["players"]} if data["de"] else {}
+        raw_players = [{**player, **de_players.get(player["number"], {})} for player in data["players"][1:]]  # First is gaia
+        restore_time = data["map"]["restore_time"]
+    duration, resigned, ratings = scan_body(handle)
+
+    players = [
+        {
+            "number": player["number"],
+            "name": player["name"].decode(encoding),
+            "civilization": dataset["civilizations"][str(player["civilization_id"])]["name"],
+            "team_id": player.get("team_id"),
+            "rate_snapshot": ratings.get(player["number"]),
+        }
+        for player in raw_players
+    ]
+
+    # Winners as mgz computes them - a team wins if none of its players resigned. Unknown if nobody resigned
+    teams = {}
+    for player in players:
+        # Team ID 1 (or no DE data) means no team - each player is on their own
+        team_id = player["team_id"] if player["team_id"] is not None and player["team_id"] > 1 else -player["number"]
+        teams.setdefault(team_id, []).append(player)
+    for team in teams.values():
+        team_lost = any(player["number"] in resigned for player in team)
+        for player in team:
+            player["winner"] = not team_lost if resigned else None
+
+    return {
+        "map": map_name,
+        "duration": timedelta(milliseconds=duration + restore_time),
+        "rated": de["rated"] if de is not None else None,
+        "players": players,
+    }
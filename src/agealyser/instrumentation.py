@@ -0,0 +1,101 @@
+"""Optional timing and memory instrumentation of the stages of the analysis. Stages of the analysis are wrapped in
+spans, which do nothing unless an Instrumentation is active:
+
+    with Instrumentation(trace_memory=True) as instrumentation:
+        AgeGame(path).advanced_parser()
+    instrumentation.to_dataframe()
+
+Each span records its wall time, CPU time and (if trace_memory) the peak memory allocated within it, along with labels
+such as the replay and player. Spans nest - the labels of the enclosing spans are inherited.
+"""
+
+import logging
+import time
+import tracemalloc
+from contextlib import contextmanager, nullcontext
+from contextvars import ContextVar
+from typing import Callable, ContextManager, Iterator, List
+
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+_active_instrumentation: ContextVar["Instrumentation | None"] = ContextVar("active_instrumentation", default=None)
+
+
+class Instrumentation:
+    """Collects a record for every span run while it is active (i.e. within its with block).
+
+    :param trace_memory: also record the peak memory allocated within each span with tracemalloc. Slows down the analysis
+    :param callback: optional function called with each record as its span finishes, e.g. to send it to a metrics system
+    """
+
+    def __init__(self, trace_memory: bool = False, callback: Callable[[dict], None] | None = None) -> None:
+        self.trace_memory = trace_memory
+        self.callback = callback
+        self.records: List[dict] = []
+        self._open_spans: List[dict] = []  # labels and peak memory of the enclosing spans
+        self._token = None
+        self._started_tracemalloc = False
+
+    def __enter__(self) -> "Instrumentation":
+        if self.trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._started_tracemalloc = True
+        self._token = _active_instrumentation.set(self)
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        _active_instrumentation.reset(self._token)
+        if self._started_tracemalloc:
+            tracemalloc.stop()
+            self._started_tracemalloc = False
+
+    @contextmanager
+    def span(self, stage: str, **labels) -> Iterator[None]:
+        """Time a stage of the analysis. Labels are added to the record, and to those of any spans within this one"""
+        parent = self._open_spans[-1] if self._open_spans else None
+        frame = {"labels": {**(parent["labels"] if parent else {}), **labels}, "peak": 0}
+        tracing = self.trace_memory and tracemalloc.is_tracing()
+        if tracing:
+            current, peak = tracemalloc.get_traced_memory()
+            if parent is not None:
+                parent["peak"] = max(parent["peak"], peak)  # Resetting the peak below would lose it for the parent
+            tracemalloc.reset_peak()
+            frame["start_memory"] = current
+
+        self._open_spans.append(frame)
+        start_wall, start_cpu = time.perf_counter(), time.process_time()
+        try:
+            yield
+        finally:
+            wall_time, cpu_time = time.perf_counter() - start_wall, time.process_time() - start_cpu
+            self._open_spans.pop()
+            record = {**frame["labels"], "stage": stage, "wall_time": wall_time, "cpu_time": cpu_time}
+            if tracing:
+                peak = max(frame["peak"], tracemalloc.get_traced_memory()[1])
+                if parent is not None:
+                    parent["peak"] = max(parent["peak"], peak)
+                record["peak_memory"] = peak - frame["start_memory"]
+            self.records.append(record)
+            if self.callback is not None:
+                self.callback(record)
+
+    def add_records(self, records: List[dict]) -> None:
+        """Add records collected elsewhere, e.g. by an Instrumentation in a worker process"""
+        for record in records:
+            self.records.append(record)
+            if self.callback is not None:
+                self.callback(record)
+
+    def to_dataframe(self) -> pd.DataFrame:
+        """All of the records, one row per span in the order they finished. Times are in seconds and memory in bytes"""
+        return pd.DataFrame(self.records)
+
+
+def span(stage: str, **labels) -> ContextManager:
+    """Span of the active Instrumentation, or a no-op if there is none - see Instrumentation.span"""
+    instrumentation = _active_instrumentation.get()
+    if instrumentation is None:
+        return nullcontext()
+    return instrumentation.span(stage, **labels)
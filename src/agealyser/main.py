@@ -3,50 +3,56 @@ import pandas as pd
 
 # import json
 # import os
+import io
 import math
-from scipy.ndimage import label, generate_binary_structure
-from scipy.spatial import distance
-from shapely import Point, Polygon
 import logging
+from functools import cached_property
 from pathlib import Path
-from typing import List
+from typing import Dict, Iterable, List
 # from typeguard import typechecked
 
 # from datetime import datetime
 # from mgz import header, fast, body
 # from mgz.enums import ObjectEnum, ResourceEnum
 # from mgz.summary import Summary
-from mgz.model import parse_match, serialize
+from mgz.model import parse_match
 
 # from utils import GamePlayer, AgeGame  # buildings model
 # import utils
 
 from .agealyser_enums import (
-    BuildTimesEnum,
-    TechnologyResearchTimes,
+    BUILD_TIMES,
+    RESEARCH_TIMES,
     # UnitCreationTime,
     MilitaryBuildings,
     FeudalAgeMilitaryUnits,
     TownCentreUnitsAndTechs,
+    ProductionBuildingUnits,
     # ArcheryRangeUnits,
     # StableUnits,
     # SiegeWorkshopUnits
 )
 
+from .cache import ReplayCache
+from .diagnostics import Diagnostics, record
+from .ingest import match_to_tables, replay_summary
+from .instrumentation import span
 from .utils import (
-    ArcheryRangeProductionBuildingFactory,
-    BarracksProductionBuildingFactory,
-    StableProductionBuildingFactory,
-    SiegeWorkshopProductionBuildingFactory,
-    TownCentreBuildingFactory,
+    ProductionBuilding,
+    ProductionEngine,
     MGZParserException,
+    dedupe_inputs,
+    construction_time,
+    villagers_building,
     AgeAlyserAnalysisError
 )
 
 logger = logging.getLogger(__name__)
-logging.basicConfig(
-    filename="AdvancedParser.log", encoding="utf-8", level=logging.DEBUG
-)
+
+# Sections of the analysis that can be requested from AgeGame.advanced_parser. Civilisations, locations and the Elo
+# difference are always returned as they are read straight from the game
+PLAYER_SECTIONS = ("uptimes", "opening", "economy", "walls")
+ANALYSIS_SECTIONS = PLAYER_SECTIONS + ("map",)
 
 
 # step one - identify the things within an AOE game that I can find, publish this as a package;
@@ -89,203 +95,429 @@ class GamePlayer:
         self.player_won: bool = winner
         self.elo: int = elo
 
-        self.inputs_df: pd.DataFrame = inputs.copy()
-        self.actions_df: pd.DataFrame = actions.copy()
+        self.inputs_df: pd.DataFrame = inputs
+        self.actions_df: pd.DataFrame = actions
 
         self.opening = pd.Series()
 
-        # Data formatting - parse str to timestamp
-        self.inputs_df.loc[:, "timestamp"] = pd.to_timedelta(
-            self.inputs_df.loc[:, "timestamp"].copy()
-        )
-        self.actions_df.loc[:, "timestamp"] = pd.to_timedelta(
-            self.actions_df.loc[:, "timestamp"].copy()
-        )
-
-        self.inputs_df["timestamp"] = self.inputs_df["timestamp"].astype(
-            "timedelta64[ns]"
-        )
-        self.actions_df["timestamp"] = self.inputs_df["timestamp"].astype(
-            "timedelta64[ns]"
-        )
-
-        # discovered an issue where records would be duplicated with around 0.2s apart
-        # iterate through df. Identify duplicate records, then drop one if necessary
-        to_drop_inputs = self.inputs_df[
-            (self.inputs_df["timestamp"].diff() < pd.Timedelta(seconds=0.25))
-            & (self.inputs_df["timestamp"] > pd.Timedelta(seconds=20))
-            & (
-                self.inputs_df.loc[:, ["type", "param", "payload.object_ids"]]
-                .eq(
-                    self.inputs_df.loc[
-                        :, ["type", "param", "payload.object_ids"]
-                    ].shift(1)
-                )
-                .all(axis=1)
-            )
-        ]
-        to_drop_inputs = to_drop_inputs.loc[
-            to_drop_inputs["type"] == "Queue", :
-        ]  # remove anything that is not Queue after
+        # Timestamps of both are timedelta64[ns] from ingestion (int64 nanoseconds of game time) - no parsing needed
 
-        self.inputs_df = self.inputs_df.drop(to_drop_inputs.index)
+        # discovered an issue where records would be duplicated with around 0.2s apart - drop the duplicates
+        self.inputs_df = dedupe_inputs(self.inputs_df)
 
         # self.actions_df.to_csv(Path(f"DataExploration/Player{self.number}_actions.csv"))
         # self.inputs_df.to_csv(Path(f"DataExploration/Player{self.number}_inputs.csv"))
 
-        # all techs researched and their completion time
-        research_techs = self.inputs_df.loc[
-            self.inputs_df["type"] == "Research", :
-        ].dropna(subset="param")
+    @cached_property
+    def end_of_game(self) -> pd.Timedelta:
+        """Time of the player's last action, i.e. when the game ended for the player"""
+        return self.actions_df["timestamp"].max()
+
+    @cached_property
+    def inputs_by_type(self) -> Dict[str, pd.DataFrame]:
+        """The player's inputs partitioned by type (Research, Build, Queue, etc.) in a single pass"""
+        return dict(tuple(self.inputs_df.groupby("type", observed=True, sort=False)))
+
+    def inputs_of_type(self, *input_types: str) -> pd.DataFrame:
+        """The player's inputs of the given types, in the order they were made"""
+        partitions = [self.inputs_by_type[input_type] for input_type in input_types if input_type in self.inputs_by_type]
+        if not partitions:
+            return self.inputs_df.iloc[0:0]
+        if len(partitions) == 1:
+            return partitions[0]
+        return pd.concat(partitions).sort_index()
+
+    # The analysis below is lazy - each piece is computed (once) only when it is first used, so that callers who only
+    # need some sections of the analysis do not pay for the rest (e.g. production buildings are only modelled for the opening)
+
+    @cached_property
+    def research_techs(self) -> pd.DataFrame:
+        """All techs researched by the player"""
+        research_techs = self.inputs_of_type("Research").dropna(subset="param")
         # if a tech is added that is not captured by the AOE parser, it will throw an error for us because "" cannot be found in Enums
-        research_techs = research_techs[research_techs["param"] != ""]
-        # can just keep this as a dictionary given its just a hashmap with 1 item
-        self.technologies = {
-            tech: self.identify_technology_research_and_time(
-                tech, research_data=research_techs, civilisation=civilisation
-            )
-            for tech in pd.unique(research_techs["param"])
+        return research_techs[research_techs["param"] != ""]
+
+    def create_production_buildings(self, building_types: List[str]) -> Dict[str, List[ProductionBuilding] | None]:
+        """Models of production buildings of the given types, by building type - see ProductionEngine"""
+        return ProductionEngine().create_production_buildings(
+            inputs_data=self.inputs_df,
+            player=self.number,
+            position_x=self.starting_position[0],  # Sometimes MGZ cannot find - set to 0,0
+            position_y=self.starting_position[1],  # there is another way to get location from player object but it is not relevant
+            building_types=building_types,
+            civilisation=self.civilisation,
+        )
+
+    @cached_property
+    def town_centre_buildings(self) -> List[ProductionBuilding] | None:
+        """Models of the town centres only - the age up times need these, but not the other production buildings"""
+        return self.create_production_buildings(["Town Center"])["Town Center"]
+
+    @cached_property
+    def production_buildings(self) -> Dict[str, List[ProductionBuilding] | None]:
+        """Models of every production building, by building type. Town centres share no units with the other buildings,
+        so they are modelled on their own and only the other types are modelled here"""
+        return {
+            "Town Center": self.town_centre_buildings,
+            **self.create_production_buildings(
+                [building_type for building_type in ProductionBuildingUnits if building_type != "Town Center"]
+            ),
         }
 
-        # Create model form town centre productions, including technologies.
-        # The reason to do here is to overwrite research times for age up and Loom/Wheel
-        self.town_centres = (
-            TownCentreBuildingFactory().create_production_building_and_remove_used_id(
-                inputs_data=self.inputs_df,
-                player=self.number,
-                position_x=self.starting_position[0],  # Sometimes MGZ cannot find - set to 0,0
-                position_y=self.starting_position[1],  # there is another way to get location from player object but it is not relevant
-            )
-        )
-        if not self.town_centres:
+    @cached_property
+    def town_centres(self) -> list:
+        """Models of town centre production, including technologies"""
+        town_centres = self.town_centre_buildings
+        if not town_centres:
             raise AgeAlyserAnalysisError(
                 "Found no town centres for this player. Without this, cannot accurately parse game"
             )
-        else:
-            self.tc_units_and_techs = pd.concat(
-                [tc_.produce_units() for tc_ in self.town_centres]
-            )
+        return town_centres
+
+    @cached_property
+    def tc_units_and_techs(self) -> pd.DataFrame:
+        return self.units_produced(self.town_centres)
+
+    @cached_property
+    def technology_table(self) -> pd.DataFrame:
+        """Every technology researched by the player, in the order first researched, in a single pass over the research
+        inputs. Indexed by technology, with when it was last clicked (ClickedTimestamp), its research time in seconds for
+        the player's civilisation (ResearchTime) and when it completed (CompletedTimestamp). Times are NaT/NaN for
+        technologies missing from the Enums
+        """
+        research_techs = self.research_techs
+        # Unsure why there is two clicks - maybe one for queue and one for actually clicking up? Bug in mgz?
+        # using the last click handles multiple like a cancel and re-research
+        clicked = research_techs.groupby(research_techs["param"].astype(object), sort=False)["timestamp"].last()
 
-        # update research times and age up times after proper unit production
-        for research in TownCentreUnitsAndTechs:
-            if research == "Villager":  # Ignore units of course
-                continue
-            # TODO-patch check this is accurate
-            if not self.tc_units_and_techs.loc[
-                self.tc_units_and_techs["param"] == research, "UnitCreatedTimestamp"
-            ].empty:
-                self.technologies[research] = self.tc_units_and_techs.loc[
-                    self.tc_units_and_techs["param"] == research, "UnitCreatedTimestamp"
-                ].to_list()[
-                    0
-                ]  # need to extract data rather than a series object
-
-        # dict for quickly accessing age up times (not click up times)
-        self.age_up_times = {
-            index
-            + 2: self.identify_technology_research_and_time(
-                age, research_techs, civilisation=self.civilisation
-            )
-            for index, age in enumerate(["Feudal Age", "Castle Age", "Imperial Age"])
-        }
+        # TODO-patch for cleanliness, think about handling this in Enum methods
+        enum_technologies = clicked.index.str.replace(" ", "_").str.replace("-", "_")
+        research_times = RESEARCH_TIMES.lookup(enum_technologies, civilisation=self.civilisation)
+        for enum_technology in enum_technologies[np.isnan(research_times)]:
+            RESEARCH_TIMES.has_value(enum_technology)  # Unknown technologies are recorded in the diagnostics
 
-        # Buildings created
-        all_buildings_created = self.inputs_df.loc[
-            (self.inputs_df["type"] == "Build") | (self.inputs_df["type"] == "Reseed"),
-            :,
-        ]
-        buildings_to_concat = [
-                self.identify_building_and_timing(
-                    building_name=building,
-                    buildings_data=all_buildings_created,
-                    feudal_time=self.age_up_times[2],
-                    castle_time=self.age_up_times[3],
-                    imperial_time=self.age_up_times[4],
-                    civilisation=self.civilisation,
-                )
-                for building in pd.unique(all_buildings_created["param"])
-            ]
-        # Need to remove empty DFs from concat
-        self.buildings = pd.concat([building for building in buildings_to_concat if not building.empty]).sort_values("timestamp")
+        return pd.DataFrame(
+            {
+                "ClickedTimestamp": clicked,
+                "ResearchTime": research_times,
+                "CompletedTimestamp": clicked + pd.to_timedelta(research_times, unit="s"),
+            }
+        ).rename_axis("Technology")
+
+    @cached_property
+    def technologies(self) -> dict:
+        """All techs researched and their completion time"""
+        # Use the model of town centre production, including technologies, to
+        # overwrite research times for age up and Loom/Wheel - the first time the town centres completed each
+        tc_units_and_techs = self.tc_units_and_techs
+        # The modelled params have underscores (e.g. Feudal_Age) - map them back to the names of the inputs (Feudal Age)
+        tc_tech_names = {
+            tech.replace(" ", "_").replace("-", "_"): tech for tech in TownCentreUnitsAndTechs if tech != "Villager"
+        }  # Ignore units of course
+        tc_techs = tc_units_and_techs["param"].map(tc_tech_names)
+        tc_completed = (
+            tc_units_and_techs["UnitCreatedTimestamp"]
+            .groupby(tc_techs, sort=False)  # Units (NaN) are dropped
+            .first()
+            .rename("TownCentreTimestamp")
+        )
+
+        # Left join keeps the order techs were researched in, TC-only techs (if any) are appended after
+        technologies = self.technology_table.join(tc_completed, how="left")
+        tc_only = tc_completed.loc[~tc_completed.index.isin(technologies.index)]
+        if not tc_only.empty:
+            technologies = pd.concat([technologies, tc_only.to_frame()])
+        completed = technologies["TownCentreTimestamp"].fillna(technologies["CompletedTimestamp"])
+        # can just keep this as a dictionary given its just a hashmap with 1 item
+        return {tech: None if pd.isna(time) else time for tech, time in completed.items()}
+
+    @cached_property
+    def age_up_times(self) -> dict:
+        """dict for quickly accessing age up times (not click up times)"""
+        self.town_centres  # A player without town centres cannot be analysed - fail here as before
+        completed = self.technology_table["CompletedTimestamp"]
+        age_up_times = {}
+        for index, age in enumerate(["Feudal Age", "Castle Age", "Imperial Age"]):
+            if age not in completed.index:
+                record("technology_not_researched", age)  # Summarised per game, see diagnostics
+            age_up_times[index + 2] = None if pd.isna(completed.get(age)) else completed[age]
+        return age_up_times
+
+    @cached_property
+    def all_buildings_created(self) -> pd.DataFrame:
+        return self.inputs_of_type("Build", "Reseed")
+
+    @cached_property
+    def building_timeline(self) -> pd.DataFrame:
+        """Every building placed (and farm reseeded) by the player, in the order they were placed. Computed once for all
+        types of building - the analysis queries this rather than the inputs.
+
+        Columns are the completion time (timestamp), player, the villagers building it (payload.object_ids), Building,
+        NumberVillsBuilding, TimeToBuild, the age it was completed in (Age, 1 = Dark Age) and PlacedTimestamp
+        """
+        buildings_created = self.all_buildings_created
+        building_names = buildings_created["param"].astype(object)
+
+        # Build time of each type of building - unknown buildings are recorded in the diagnostics and left out
+        build_times = {}
+        for building_name in pd.unique(building_names.dropna()):
+            # TODO for cleanliness, think about handling this in Enum methods
+            enum_building_name = building_name.replace(" ", "_").replace("-", "_")
+            if BUILD_TIMES.has_value(enum_building_name):
+                build_times[building_name] = BUILD_TIMES.get(enum_building_name, civilisation=self.civilisation)
+        time_to_build = building_names.map(build_times)
+        known_building = time_to_build.notna()
+        buildings_created, building_names = buildings_created.loc[known_building], building_names.loc[known_building]
+
+        # The villagers building are the payload.object_ids - when MGZ cannot find them, assume 1 villager
+        number_vills_building = villagers_building(buildings_created["payload.object_ids"])
+        time_to_build = construction_time(time_to_build.loc[known_building], number_vills_building)
+        completed = buildings_created["timestamp"] + time_to_build
+
+        # Age of building creation
+        age = pd.Series(1, index=buildings_created.index)  # default is dark age
+        for index, age_time in enumerate([self.age_up_times[2], self.age_up_times[3], self.age_up_times[4]]):
+            if age_time is not None:
+                age.loc[completed > age_time] = index + 2  # +2 as need to map from 0= Feudal to Feudal = 2 and so on
+
+        return pd.DataFrame(
+            {
+                "timestamp": completed,
+                "player": buildings_created["player"],
+                "payload.object_ids": buildings_created["payload.object_ids"],
+                "Building": building_names,
+                "NumberVillsBuilding": number_vills_building,
+                "TimeToBuild": time_to_build,
+                "Age": age,
+                "PlacedTimestamp": buildings_created["timestamp"],
+            }
+        )
 
-        # Split into military production buildings and everything else
-        # TODO-patch check if this is used anywhere
-        self.military_buildings_created = all_buildings_created[
-            all_buildings_created.loc[:, "param"].isin(MilitaryBuildings)
+    def buildings_placed(
+        self, building_name: str, placed_after: pd.Timedelta | None = None, placed_before: pd.Timedelta | None = None
+    ) -> pd.DataFrame:
+        """Rows of the building timeline for one type of building, optionally placed strictly between two times"""
+        timeline = self.building_timeline
+        selected = timeline["Building"] == building_name
+        if placed_after is not None:
+            selected &= timeline["PlacedTimestamp"] > placed_after
+        if placed_before is not None:
+            selected &= timeline["PlacedTimestamp"] < placed_before
+        return timeline.loc[selected]
+
+    @cached_property
+    def buildings(self) -> pd.DataFrame:
+        """Buildings created and their completion times, in the order they were completed"""
+        return self.building_timeline.sort_values("timestamp")
+
+    # Split into military production buildings and everything else
+    # TODO-patch check if this is used anywhere
+    @cached_property
+    def military_buildings_created(self) -> pd.DataFrame:
+        return self.all_buildings_created[
+            self.all_buildings_created.loc[:, "param"].isin(MilitaryBuildings)
         ].copy()
 
-        self.economic_buildings_created = all_buildings_created[
-            ~all_buildings_created.loc[:, "param"].isin(
+    @cached_property
+    def economic_buildings_created(self) -> pd.DataFrame:
+        return self.all_buildings_created[
+            ~self.all_buildings_created.loc[:, "param"].isin(
                 MilitaryBuildings
             )  # Note not (~)
         ].copy()
 
-        # Player walls - Palisade Wall(s) and Stone Wall(s)
-        self.player_walls = self.inputs_df.loc[self.inputs_df["type"] == "Wall", :]
-
-        # Units and unqueing. Note that unqueuing is not possible to handle...
-        self.queue_units = self.inputs_df.loc[self.inputs_df["type"] == "Queue", :]
-        self.unqueue_units = self.inputs_df.loc[self.inputs_df["type"] == "Unqueue", :]
-
-        # Create models for archery ranges, stables etc.
-        # These production buildings allow us to see when a unit is CREATED rather than queued. Otherwise, we only see the time
-        # the player clicks the unit/technology etc, not when it is completed.
-        self.archery_ranges = ArcheryRangeProductionBuildingFactory().create_production_building_and_remove_used_id(
-            inputs_data=self.inputs_df, player=self.number
+    @cached_property
+    def player_walls(self) -> pd.DataFrame:
+        """Player walls - Palisade Wall(s) and Stone Wall(s)"""
+        return self.inputs_of_type("Wall")
+
+    # Units and unqueing. Note that unqueuing is not possible to handle...
+    @cached_property
+    def queue_units(self) -> pd.DataFrame:
+        return self.inputs_of_type("Queue")
+
+    @cached_property
+    def unqueue_units(self) -> pd.DataFrame:
+        return self.inputs_of_type("Unqueue")
+
+    # Create models for archery ranges, stables etc.
+    # These production buildings allow us to see when a unit is CREATED rather than queued. Otherwise, we only see the time
+    # the player clicks the unit/technology etc, not when it is completed.
+    @staticmethod
+    def units_produced(production_buildings: list | None) -> pd.DataFrame:
+        """All the units created by a set of production buildings"""
+        if production_buildings is not None and len(production_buildings) > 0:
+            units = []
+            for building in production_buildings:
+                with span("produce_units", building=building.building_type, building_id=building.id):
+                    units.append(building.produce_units())
+            return pd.concat(units)
+        return pd.DataFrame()
+
+    @cached_property
+    def archery_ranges(self) -> list | None:
+        return self.production_buildings["Archery Range"]
+
+    @cached_property
+    def archery_units(self) -> pd.DataFrame:
+        return self.units_produced(self.archery_ranges)
+
+    @cached_property
+    def barracks(self) -> list | None:
+        return self.production_buildings["Barracks"]
+
+    @cached_property
+    def barracks_units(self) -> pd.DataFrame:
+        return self.units_produced(self.barracks)
+
+    @cached_property
+    def stables(self) -> list | None:
+        return self.production_buildings["Stable"]
+
+    @cached_property
+    def stable_units(self) -> pd.DataFrame:
+        return self.units_produced(self.stables)
+
+    @cached_property
+    def siege_shops(self) -> list | None:
+        return self.production_buildings["Siege Workshop"]
+
+    @cached_property
+    def siege_units(self) -> pd.DataFrame:
+        return self.units_produced(self.siege_shops)
+
+    @cached_property
+    def castles(self) -> list | None:
+        return self.production_buildings["Castle"]
+
+    @cached_property
+    def castle_units(self) -> pd.DataFrame:
+        return self.units_produced(self.castles)
+
+    @cached_property
+    def donjons(self) -> list | None:
+        return self.production_buildings["Donjon"]
+
+    @cached_property
+    def donjon_units(self) -> pd.DataFrame:
+        return self.units_produced(self.donjons)
+
+    @cached_property
+    def kreposts(self) -> list | None:
+        return self.production_buildings["Krepost"]
+
+    @cached_property
+    def krepost_units(self) -> pd.DataFrame:
+        return self.units_produced(self.kreposts)
+
+    @cached_property
+    def docks(self) -> list | None:
+        return self.production_buildings["Dock"]
+
+    @cached_property
+    def dock_units(self) -> pd.DataFrame:
+        return self.units_produced(self.docks)
+
+    @cached_property
+    def monasteries(self) -> list | None:
+        return self.production_buildings["Monastery"]
+
+    @cached_property
+    def monastery_units(self) -> pd.DataFrame:
+        return self.units_produced(self.monasteries)
+
+    @cached_property
+    def military_units(self) -> pd.DataFrame:
+        """data structure to hold all military units - land units, ships and monks are kept separately"""
+        return pd.concat(
+            [
+                self.archery_units,
+                self.barracks_units,
+                self.stable_units,
+                self.siege_units,
+                self.castle_units,
+                self.donjon_units,
+                self.krepost_units,
+            ]
         )
-        if self.archery_ranges is not None and len(self.archery_ranges) > 0:
-            self.archery_units = pd.concat(
-                [range_.produce_units() for range_ in self.archery_ranges]
-            )
-        else:
-            self.archery_units = pd.DataFrame()
 
-        # Barracks
-        self.barracks = BarracksProductionBuildingFactory().create_production_building_and_remove_used_id(
-            inputs_data=self.inputs_df, player=self.number
-        )
-        if self.barracks is not None and len(self.barracks) > 0:
-            self.barracks = pd.concat(
-                [range_.produce_units() for range_ in self.barracks]
-            )
-        else:
-            self.barracks = pd.DataFrame()
+    @cached_property
+    def military_buildings(self) -> List[ProductionBuilding]:
+        """Models of the buildings that produce the military units - see military_units"""
+        return [
+            building
+            for buildings in [
+                self.archery_ranges,
+                self.barracks,
+                self.stables,
+                self.siege_shops,
+                self.castles,
+                self.donjons,
+                self.kreposts,
+            ]
+            for building in buildings or []
+        ]
 
-        self.stables = StableProductionBuildingFactory().create_production_building_and_remove_used_id(
-            inputs_data=self.inputs_df, player=self.number
-        )
-        if self.stables is not None and len(self.stables) > 0:
-            self.stable_units = pd.concat(
-                [stable.produce_units() for stable in self.stables]
-            )
-        else:
-            self.stable_units = pd.DataFrame()
+    def town_centre_idle_time(self, start: pd.Timedelta, end: pd.Timedelta) -> float:
+        """Seconds the player's town centres were not producing villagers or researching between start and end - see
+        ProductionBuilding.count_building_idle_time. NaN if no villagers were modelled, e.g. because mgz could not read
+        the queue commands of the game, as the idle time would only account for the technologies"""
+        if not (self.tc_units_and_techs["param"] == "Villager").any():
+            return np.nan
+        return sum(town_centre.count_building_idle_time(start, end) for town_centre in self.town_centres)
 
-        self.siege_shops = SiegeWorkshopProductionBuildingFactory().create_production_building_and_remove_used_id(
-            inputs_data=self.inputs_df, player=self.number
-        )
-        if self.siege_shops is not None and len(self.siege_shops) > 0:
-            self.siege_units = pd.concat(
-                [seige_shop.produce_units() for seige_shop in self.siege_shops]
-            )
-        else:
-            self.siege_units = pd.DataFrame()
+    def military_building_utilisation(self, age_times: List[pd.Timedelta]) -> pd.Series:
+        """Fraction of the time the player's military buildings spent producing in each age, from when each was completed
 
-        # data structure to hold all military units
-        self.military_units = pd.concat(
-            [self.archery_units, self.barracks, self.stable_units, self.siege_units]
-        )
-        # TODO-feature - castle, donjon, dock. Lots of boiler plate
+        :param age_times: start of the game, the time each age was reached and the end of the game, in order
+        :return: utilisation of each age, NaN for an age without military buildings
+        :rtype: pd.Series
+        """
+        edges = pd.TimedeltaIndex(age_times)
+        busy, available = np.zeros(len(edges) - 1), np.zeros(len(edges) - 1)
+        for building in self.military_buildings:
+            busy += np.diff(building.busy_time(edges))
+            built_at = building.built_at if building.built_at is not None else edges[0]
+            available += np.clip((edges[1:] - np.maximum(edges[:-1], built_at)).total_seconds(), 0, None)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            utilisation = np.where(available > 0, busy / available, np.nan)
+        ages = ["DarkAge", "FeudalAge", "CastleAge", "ImperialAge"][: len(utilisation)]
+        return pd.Series(utilisation, index=[f"{age}MilitaryUtilisation" for age in ages])
+
+    def production_utilisation_timeline(self, freq: pd.Timedelta = pd.Timedelta(minutes=1)) -> pd.DataFrame:
+        """Utilisation of each of the player's production buildings over the game - see
+        ProductionBuilding.utilisation_timeline
+
+        :param freq: length of each period of the timeline
+        :return: one row per building and period, with the building's type and ID, the start of the period and utilisation
+        :rtype: pd.DataFrame
+        """
+        timelines = [
+            building.utilisation_timeline(end=self.end_of_game, freq=freq)
+            .rename_axis("period")
+            .reset_index()
+            .assign(building_type=building.building_type, building_id=building.id)
+            for buildings in self.production_buildings.values()
+            for building in buildings or []
+        ]
+        if not timelines:
+            return pd.DataFrame(columns=["building_type", "building_id", "period", "utilisation"])
+        return pd.concat(timelines, ignore_index=True)[["building_type", "building_id", "period", "utilisation"]]
 
     def full_player_choices_and_strategy(
         self,
         feudal_time: pd.Timedelta,
         castle_time: pd.Timedelta | None,
-        loom_time: pd.Timedelta,
+        loom_time: pd.Timedelta | None,
         end_of_game: pd.Timedelta,
         civilisation: str,
+        sections: Iterable[str] = PLAYER_SECTIONS,
     ) -> pd.Series:
-        """Main API - call to analyse the player's choices"""
+        """Main API - call to analyse the player's choices
+
+        :param sections: which parts of the analysis to run - any of "uptimes", "opening", "economy" and "walls".
+            Only the data needed for these sections is computed
+        """
 
         # Extract the key statistics / data points
         # research age timings and loom to mine out
@@ -294,43 +526,47 @@ class GamePlayer:
         if castle_time is None:
             castle_time = end_of_game  # end of the game
 
-        self.dark_age_stats = self.extract_feudal_uptime_info(
-            feudal_time=feudal_time, loom_time=loom_time, civilisation=civilisation
-        )
+        to_concat = [self.opening] if not self.opening.empty else []  # concat of empty Series is deprecated
+
+        if "uptimes" in sections:
+            with span("uptimes"):
+                self.dark_age_stats = self.extract_feudal_uptime_info(
+                    feudal_time=feudal_time, loom_time=loom_time, civilisation=civilisation
+                )
+            to_concat.append(self.dark_age_stats)
 
         # Identify Feudal and Dark Age military Strategy
-        self.opening_strategy = self.extract_opening_strategy(
-            feudal_time=feudal_time,
-            castle_time=castle_time,
-            mills_building_data=self.buildings.loc[
-                self.buildings["Building"] == "Mill", :
-            ],
-            technologies_researched=self.technologies,
-            military_buildings_spawned=self.military_buildings_created,
-            units_queued=self.military_units,
-        )
+        if "opening" in sections:
+            with span("opening"):
+                self.opening_strategy = self.extract_opening_strategy(
+                    feudal_time=feudal_time,
+                    castle_time=castle_time,
+                    technologies_researched=self.technologies,
+                    units_queued=self.military_units,
+                )
+                imperial_time = self.age_up_times[4] if self.age_up_times[4] is not None else end_of_game
+                military_utilisation = self.military_building_utilisation(
+                    [pd.Timedelta(0), feudal_time, castle_time, max(imperial_time, castle_time), end_of_game]
+                )
+            to_concat.extend([self.opening_strategy, military_utilisation])
 
         # Identify Feudal and Dark Age economic choices
-        self.feudal_economic_choices_and_castle_time = (
-            self.extract_early_game_economic_strat(
-                castle_time=castle_time,
-                feudal_time=feudal_time,
-                player_eco_buildings=self.economic_buildings_created,
-                player_walls=self.player_walls.loc[
-                    self.player_walls["payload.building"] == "Palisade Wall", :
-                ],
-                technologies=self.technologies,
-            )
-        )
+        if "economy" in sections or "walls" in sections:
+            with span("economy"):
+                self.feudal_economic_choices_and_castle_time = (
+                    self.extract_early_game_economic_strat(
+                        castle_time=castle_time,
+                        feudal_time=feudal_time,
+                        player_walls=self.player_walls.loc[
+                            self.player_walls["payload.building"] == "Palisade Wall", :
+                        ],
+                        technologies=self.technologies if "economy" in sections else {},
+                        sections=sections,
+                    )
+                )
+            to_concat.append(self.feudal_economic_choices_and_castle_time)
 
-        self.opening = pd.concat(
-            [
-                self.opening,
-                self.dark_age_stats,
-                self.opening_strategy,
-                self.feudal_economic_choices_and_castle_time,
-            ]
-        )
+        self.opening = pd.concat(to_concat)
 
         return self.opening
 
@@ -342,123 +578,6 @@ class GamePlayer:
         """Wrapper to return civilisation pandas friendly"""
         return pd.Series({"Civilisation": self.civilisation})
 
-    def identify_technology_research_and_time(
-        self, technology: str, research_data: pd.DataFrame, civilisation: str = None
-    ) -> pd.Timedelta | None:
-        """A helper method that can identify when players research certain things and the timing of that
-
-        :param technology: technology being researches
-        :type technology: str
-        :param civilisations: civilisations to handle faster research times, defaults to None
-        :type civilisations: dict, optional
-        :raises ValueError: incorrect technology passed
-        :return: data frame with the time each player researched and completed the technology
-        :rtype: pd.DataFrame
-        """
-        enum_technology = technology.replace(" ", "_").replace(
-            "-", "_"
-        )  # TODO-patch for cleanliness, think about handling this in Enum methods
-
-        if not TechnologyResearchTimes.has_value(enum_technology):
-            logger.error(
-                f"Technology could not be found in Enums. Tech was: {technology}"
-            )
-            # consider warning and gracefully returning None rather than failing
-            # in the case of an invalid string, the Enum will raise an error. In other cases, just warn the user.
-            # raise ValueError(f"Couldn't find technology: {technology} (Enum: {enum_technology}). Please raise this issue on GitHub.")
-            return None  # return empty data a time for this tech
-        time_to_research = TechnologyResearchTimes.get(
-            enum_technology, civilisation=civilisation
-        )
-
-        # Unsure why there is two clicks - maybe one for queue and one for actually clicking up? Bug in mgz?
-        # Handle two clicks
-        relevent_research = research_data.loc[
-            research_data["param"] == technology, "timestamp"
-        ]  # handle unqueue
-
-        if relevent_research.empty:
-            # Log if no data can be found for a technology.
-            logger.warning(f"Could not find any parsed game data for a researched tech ({technology}). Check why this is searched for.")
-            return None
-
-        # using len here handles multiple like a cancel and re-research
-        return relevent_research.iloc[len(relevent_research) - 1] + pd.Timedelta(
-            seconds=time_to_research
-        )
-
-    def identify_building_and_timing(
-        self,
-        building_name: str,
-        buildings_data: pd.DataFrame,
-        feudal_time: pd.Timedelta | None,
-        castle_time: pd.Timedelta | None,
-        imperial_time: pd.Timedelta | None,
-        civilisation: str = None,
-    ) -> pd.DataFrame:
-        """Helper to find all the creations of an economic building type.
-
-        :param building: the string name of the building. See enums for validation. Errors if incorrect
-        :param civilisations: player's civilisation, defaults to None
-        :raises ValueError: _description_
-        :return: df with all the instances of building creation and time of completion
-        :rtype: pd.DataFrame
-        """
-
-        enum_building_name = building_name.replace(" ", "_").replace(
-            "-", "_"
-        )  # TODO for cleanliness, think about handling this in Enum methods
-
-        if not BuildTimesEnum.has_value(enum_building_name):
-            logger.error(
-                f"Building given to find building method incorrect. Building was: {building_name}"
-            )
-            # No longer error if building cant be found - let Enum handle erroring on a bad MGZ Parse
-            # raise ValueError(f"Couldn't find building: {building_name}")
-            return pd.DataFrame(columns=buildings_data)  # return an empty dataframe
-
-        time_to_build = BuildTimesEnum.get(
-            enum_building_name, civilisation=civilisation
-        )
-
-        relevent_building = buildings_data.loc[
-            buildings_data["param"] == building_name,
-            ["timestamp", "player", "payload.object_ids"],
-        ]
-        if relevent_building.empty:
-            # log this and return empty data frame but with correct columns - handle accordingly
-            logger.warning(f"Building was never built according to parsed game data ({building_name})")
-            return relevent_building
-
-        # Handle case where MGZ cannot find the payload.object_ids - in other words the vils building the building
-        if relevent_building["payload.object_ids"].isna().any():
-            # In this case, just assume 1 vil and circumvent failure below
-            relevent_building.loc[relevent_building["payload.object_ids"].isna(), "payload.object_ids"] = [0]
-
-        relevent_building["Building"] = building_name
-        relevent_building["NumberVillsBuilding"] = relevent_building[
-            "payload.object_ids"
-        ].apply(lambda x: len(x))
-        relevent_building["TimeToBuild"] = (3 * time_to_build) / (
-            relevent_building["NumberVillsBuilding"] + 2
-        )
-        relevent_building["TimeToBuild"] = pd.to_timedelta(
-            relevent_building["TimeToBuild"], unit="s"
-        )
-        relevent_building["timestamp"] = (
-            relevent_building["timestamp"] + relevent_building["TimeToBuild"]
-        )
-
-        # Age of building creation
-        relevent_building["Age"] = 1  # default is dark age
-        for index, time in enumerate([feudal_time, castle_time, imperial_time]):
-            if time is not None:
-                relevent_building.loc[relevent_building["timestamp"] > time, "Age"] = (
-                    index + 2
-                )  # +2 as need to map from 0= Feudal to Feudal = 2 and so on
-
-        return relevent_building
-
     def extract_feudal_uptime_info(
         self,
         feudal_time: pd.Timedelta,
@@ -478,7 +597,7 @@ class GamePlayer:
         """
         # Need to remove the age up time which is built into the feudal time passed to this function
         feudal_click_up_time = feudal_time - pd.Timedelta(
-            seconds=TechnologyResearchTimes.get("Feudal_Age", civilisation=civilisation)
+            seconds=RESEARCH_TIMES.get("Feudal_Age", civilisation=civilisation)
         )
         loom_in_dark_age = (
             loom_time < feudal_time
@@ -489,7 +608,7 @@ class GamePlayer:
         if loom_in_dark_age:
             # Need to also remove loom if it was before feudal
             feudal_click_up_time - pd.Timedelta(
-                seconds=TechnologyResearchTimes.get("Loom", civilisation=civilisation)
+                seconds=RESEARCH_TIMES.get("Loom", civilisation=civilisation)
             )
         villager_creation_time = (
             25 if civilisation != "Persians" else 25 * 0.95
@@ -506,14 +625,13 @@ class GamePlayer:
             # assume approx two - a skilled player can get this to near 2.5, which may lead to innaccurate results
             number_villagers += 2
 
-        # Get idle time from ms in timedelta
-        # TODO-Feature this is no longer correct because of innaccuracies in Feudal Time calculation from mgz package
-        # dark_age_idle_time = (villager_analysis._ms * villager_creation_time) / 1000  # convert ms to s, this is % of villager time
+        # Idle time from the model of town centre production, rather than from the feudal time
+        dark_age_idle_time = self.town_centre_idle_time(start=pd.Timedelta(0), end=feudal_time)
 
         feudal_stats_to_return = {
             "FeudalTime": feudal_time,
             "Villagers": number_villagers,
-            # "DarkAgeIdleTime": dark_age_idle_time,
+            "DarkAgeTownCentreIdleTime": dark_age_idle_time,
             "DarkAgeLoom": loom_in_dark_age,
         }
 
@@ -523,8 +641,6 @@ class GamePlayer:
         self,
         feudal_time: pd.Timedelta,
         castle_time: pd.Timedelta,
-        military_buildings_spawned: pd.DataFrame,
-        mills_building_data: pd.DataFrame,
         technologies_researched: dict,
         units_queued: pd.DataFrame,
     ) -> pd.Series:
@@ -532,13 +648,13 @@ class GamePlayer:
         # time of maa tech for maa function
         maa_time: pd.Timedelta | None = technologies_researched.get("Man-At-Arms", None)
         # time of first mill for maa function
+        mills_building_data = self.buildings_placed("Mill")
         first_mill_time = mills_building_data["timestamp"].min() if not mills_building_data["timestamp"].empty else None
 
         # identify drush and categorise into MAA/Pre-mill/Drush
         dark_age_approach = self.militia_based_strategy(
             feudal_time=feudal_time,
             castle_time=castle_time,
-            military_buildings_spawned=military_buildings_spawned,
             mill_created_time=first_mill_time,
             units_created=units_queued,
             maa_upgrade=maa_time,
@@ -615,26 +731,15 @@ class GamePlayer:
         self,
         feudal_time: pd.Timedelta,
         castle_time: pd.Timedelta | None,  # None in case of game ending in Feudal
-        military_buildings_spawned: pd.DataFrame,
         mill_created_time: pd.Timedelta | None,  # None in case of no mills
         units_created: pd.DataFrame,
         maa_upgrade: pd.Timedelta | None = None,  # None in case of not researched
     ) -> pd.Series:
         """Logic to identify groups of MAA or Militia based strategy: MAA, pre-mill drush, drush"""
         # Identify key timings and choices associated with these strategies
-        dark_age_feudal_barracks: pd.DataFrame = military_buildings_spawned.loc[
-            (military_buildings_spawned["param"] == "Barracks")
-            & (military_buildings_spawned["timestamp"] < castle_time),
-            :,
-        ]
-        dark_age_feudal_barracks: pd.DataFrame = self.identify_building_and_timing(
-            "Barracks",
-            dark_age_feudal_barracks,
-            feudal_time=feudal_time,
-            castle_time=castle_time,
-            imperial_time=None,
-            civilisation=self.civilisation,
-        )
+        dark_age_feudal_barracks: pd.DataFrame = self.buildings_placed("Barracks", placed_before=castle_time)
+        if dark_age_feudal_barracks.empty:
+            record("building_not_built", "Barracks")
         first_barracks_time: pd.Timedelta | None = dark_age_feudal_barracks["timestamp"].min() if not dark_age_feudal_barracks["timestamp"].empty else None
         
         pre_mill_barracks: bool = first_barracks_time < mill_created_time if first_barracks_time is not None else False
@@ -690,8 +795,6 @@ class GamePlayer:
         :type feudal_time: pd.Timedelta
         :param castle_time: _description_
         :type castle_time: pd.Timedelta
-        :param military_buildings_spawned: _description_
-        :type military_buildings_spawned: pd.DataFrame
         :param units_queued: _description_
         :type units_queued: pd.DataFrame
         :return: _description_
@@ -766,13 +869,14 @@ class GamePlayer:
         self,
         feudal_time: pd.Timedelta,
         castle_time: pd.Timedelta,
-        player_eco_buildings: pd.DataFrame,
         player_walls: pd.DataFrame,
         technologies: dict,
+        sections: Iterable[str] = ("economy", "walls"),
     ) -> pd.Series:
 
         # TODO - extract information from the dark age: sheep, deer, boars, berries
         # dark_age_economic_development = self.extract_dark_age_economic_tactics()
+        stats_to_concat = []
 
         # Feudal age wood and farm upgrade;
         double_bit_axe_time = technologies.get("Double-Bit Axe", None)
@@ -788,18 +892,16 @@ class GamePlayer:
         )
 
         # Extract how quickly they develop their farming economy
-        farm_development = self.farm_economic_development(
-            feudal_time, castle_time, player_eco_buildings
-        )
+        if "economy" in sections:
+            farm_development = self.farm_economic_development(feudal_time, castle_time)
+            stats_to_concat.extend([feudal_technology_times, farm_development])
         # Extract when/if they choose to wall their map
-        walling_tactics = self.walling_tactics(
-            feudal_time, castle_time, player_eco_buildings, player_walls
-        )
+        if "walls" in sections:
+            walling_tactics = self.walling_tactics(feudal_time, castle_time, player_walls)
+            stats_to_concat.append(walling_tactics)
 
         # Concat to pandas series and return
-        stats_to_return = pd.concat(
-            [feudal_technology_times, farm_development, walling_tactics]
-        )
+        stats_to_return = pd.concat(stats_to_concat)
         return stats_to_return
 
     def dark_age_economic_tactics(self) -> pd.Series:
@@ -813,28 +915,20 @@ class GamePlayer:
         self,
         feudal_time: pd.Timedelta,
         castle_time: pd.Timedelta,
-        player_eco_buildings: pd.DataFrame,
     ) -> pd.Series:
         """Parse the economic buildings created for farms built and reseeded; note timing
 
         :param feudal_time: _description_
         :param castle_time: _description_
-        :param player_eco_buildings: _description_
         :return: _description_
         :rtype: pd.Series
         """
         # feudal age number of farms
         # find all "Reseed" inputs and "Build - Farm actions"
         # TODO - understand if a built farm is deleted
-        farms_in_feudal: pd.DataFrame = player_eco_buildings.loc[
-            (player_eco_buildings["payload.building"] == "Farm")
-            & (player_eco_buildings["timestamp"] > feudal_time)
-            & (player_eco_buildings["timestamp"] < castle_time),
-            :,
-        ]
-        farms_in_feudal: pd.DataFrame = self.identify_building_and_timing(
-            "Farm", farms_in_feudal, feudal_time, castle_time, None, self.civilisation
-        )
+        farms_in_feudal: pd.DataFrame = self.buildings_placed("Farm", placed_after=feudal_time, placed_before=castle_time)
+        if farms_in_feudal.empty:
+            record("building_not_built", "Farm")
         number_farms_made: int = len(farms_in_feudal)
         # time of 3, 6, 10, 15, 20 farms
         farms_results = pd.Series(
@@ -863,13 +957,11 @@ class GamePlayer:
         self,
         feudal_time: pd.Timedelta,
         castle_time: pd.Timedelta,
-        player_eco_buildings: pd.DataFrame,
         player_walls: pd.DataFrame,
     ) -> pd.Series:
         """Helper function to extract walls built in the early game
         :param feudal_time: _description_
         :param castle_time: _description_
-        :param player_eco_buildings: _description_
         :return: _description_
         :rtype: pd.Series
         """
@@ -879,14 +971,7 @@ class GamePlayer:
         # Houses - for the moment limit to feudal. Number of Houses is probably a poor proxy for identifying walling tactics,
         # as they aren't always used to reinforce walls
         # Some sort of really complicated location analysis would be required to amend this - I will not go down this path.
-        houses_built = player_eco_buildings.loc[
-            player_eco_buildings["payload.building"] == "House", "timestamp"
-        ]
-        feudal_houses: int = len(
-            houses_built.loc[
-                (houses_built > feudal_time) & (houses_built < castle_time)
-            ]
-        )
+        feudal_houses: int = len(self.buildings_placed("House", placed_after=feudal_time, placed_before=castle_time))
 
         # Walls - # calculate chebyshev distance of each wall segment - sum in each age
         palisade_walls = player_walls.loc[
@@ -903,12 +988,10 @@ class GamePlayer:
             })
 
         # Calculate chebyshev distance between the wall start and end to get # of tiles
-        palisade_walls["NumberTilesPlaced"] = palisade_walls.apply(
-            lambda x: distance.chebyshev(
-                x[["position.x", "position.y"]], x[["payload.x_end", "payload.y_end"]]  # payload.x_end and .y_end throw key errors on empty DF
-            ),
-            axis=1,
-        )
+        starts = palisade_walls[["position.x", "position.y"]].to_numpy(dtype=float)
+        # payload.x_end and .y_end throw key errors on empty DF
+        ends = palisade_walls[["payload.x_end", "payload.y_end"]].to_numpy(dtype=float)
+        palisade_walls["NumberTilesPlaced"] = np.abs(starts - ends).max(axis=1)
         dark_age_walls = palisade_walls.loc[
             palisade_walls["timestamp"] < feudal_time, "NumberTilesPlaced"
         ].sum()
@@ -936,9 +1019,10 @@ class GamePlayer:
 class AgeMap:
     """Data structure representing the AOE2 map. Goal of identifying and extracting map features for analysis"""
 
-    def __init__(self, map: dict, gaia: List[dict], player_starting_locations: list) -> None:
+    def __init__(self, map: dict, gaia: pd.DataFrame | List[dict], player_starting_locations: list) -> None:
         """Reconstruct the key features of the map - terrain, relics, resources (trees, gold, stone, berries).
-        Store this information in a dataframe"""
+        Store this information in a dataframe. The map tiles (map["tiles"]) and gaia objects can be given as DataFrames
+        with x and y columns, or as serialised mgz dicts"""
 
         # Map object
         self.map: dict = map  # Store map object
@@ -948,25 +1032,14 @@ class AgeMap:
         self.map_name: str = self.map["name"]
 
         # Distribution of starting objects
-        self.tiles_raw: List[dict] = gaia
-        self.tiles = pd.DataFrame(gaia)
-        self.tiles = self.tiles.join(
-            self.tiles["position"].apply(pd.Series), validate="one_to_one"
-        )  # Explode out dict into cols for x + y
+        self.tiles_raw: pd.DataFrame | List[dict] = gaia
+        self.tiles = self.split_positions(gaia)  # Columns for x + y
 
         self.tiles["x"] = self.tiles["x"].astype(int)
         self.tiles["y"] = self.tiles["y"].astype(int)
 
-        self.elevation_map: pd.DataFrame = pd.DataFrame(
-            self.map["tiles"]
-        )  # Elevation of each tile
-        # Explode out dict into cols for x + y
-        self.elevation_map = self.elevation_map.join(
-            self.elevation_map["position"].apply(pd.Series), validate="one_to_one"
-        )
-        self.elevation_map = self.elevation_map.drop(
-            columns=["position", "terrain"]
-        )  # clean up columns
+        # Elevation of each tile. Columns for x + y, clean up the terrain column
+        self.elevation_map: pd.DataFrame = self.split_positions(self.map["tiles"]).drop(columns=["terrain"])
 
         # Join elevation on - note have to use x and y as ofc no object ID for terrain
         self.tiles = self.tiles.merge(self.elevation_map, on=["x", "y"], how="left")
@@ -1047,6 +1120,16 @@ class AgeMap:
 
         return
 
+    @staticmethod
+    def split_positions(objects: pd.DataFrame | List[dict]) -> pd.DataFrame:
+        """Tiles and objects come either as a DataFrame with x and y columns, or as serialised mgz dicts with a nested
+        position dict. Return a DataFrame with x and y columns"""
+        if isinstance(objects, pd.DataFrame):
+            return objects.copy()
+        df = pd.DataFrame(objects)
+        positions = pd.DataFrame(df.pop("position").to_list(), index=df.index)  # Explode out dict into cols for x + y
+        return df.join(positions, validate="one_to_one")
+
     def analyse_map_features_for_player(
         self, player: int, player_resources: pd.DataFrame, min_height_for_hill: int
     ) -> pd.Series:
@@ -1071,22 +1154,14 @@ class AgeMap:
 
         # Golds - identify main and secondary golds and get their dataframe
         golds = player_resources.loc[player_resources["name"] == "Gold Mine", :]
-        sizes_of_golds = golds.groupby(
-            "Gold Mine"
-        ).count()  # TODO there is a much better way of doing this - col for each type is not good
+        sizes_of_golds = golds.groupby("island_id").count()
         main_gold_index = sizes_of_golds["instance_id"].idxmax()
-        main_gold = player_resources.loc[
-            player_resources["Gold Mine"] == main_gold_index
-        ]
+        main_gold = golds.loc[golds["island_id"] == main_gold_index]
         list_of_ids_for_secondary_golds = (
             sizes_of_golds["instance_id"].drop(index=main_gold_index).index.to_list()
         )
-        secondary_gold_one = player_resources.loc[
-            player_resources["Gold Mine"] == list_of_ids_for_secondary_golds[0]
-        ]
-        secondary_gold_two = player_resources.loc[
-            player_resources["Gold Mine"] == list_of_ids_for_secondary_golds[1]
-        ]
+        secondary_gold_one = golds.loc[golds["island_id"] == list_of_ids_for_secondary_golds[0]]
+        secondary_gold_two = golds.loc[golds["island_id"] == list_of_ids_for_secondary_golds[1]]
 
         # Apply rules to main gold - Back, Front or Front Hill
         main_gold_analysis = self.analyse_resource(
@@ -1132,13 +1207,9 @@ class AgeMap:
 
         # identify main stone
         stones = player_resources.loc[player_resources["name"] == "Stone Mine", :]
-        sizes_of_stones = stones.groupby(
-            "Stone Mine"
-        ).count()  # TODO there are better ways of doing this - col for each type is not good
+        sizes_of_stones = stones.groupby("island_id").count()
         main_stone_index = sizes_of_stones["instance_id"].max()
-        main_stone = player_resources.loc[
-            player_resources["Stone Mine"] == main_stone_index
-        ]
+        main_stone = stones.loc[stones["island_id"] == main_stone_index]
         stone_between_players = main_stone["BetweenPlayers"].max() if not main_stone["BetweenPlayers"].empty else False
 
         # Apply to analysis method (Hill/Front/Back) to stone
@@ -1180,7 +1251,7 @@ class AgeMap:
                 analysis = "Back"
             case _:
                 analysis = "Unknown"
-                logger.info(f"Could not analyse resource correctly. {between_players}, {average_height_above_tc}")  # log unknown
+                record("resource_not_analysed", (bool(between_players), bool(average_height_above_tc)))  # record unknown
         return analysis
 
     def analyse_player_woodlines(
@@ -1193,8 +1264,8 @@ class AgeMap:
         :return: series with summary information
         """
         woodlines_dict = {"Front": 0, "Side": 0, "Back": 0}
-        for woodline_index in pd.unique(woodlines["Tree"]):
-            wood = woodlines.loc[woodlines["Tree"] == woodline_index, :]
+        for woodline_index in pd.unique(woodlines["island_id"]):
+            wood = woodlines.loc[woodlines["island_id"] == woodline_index, :]
             number_trees_forward: int = len(
                 wood.loc[wood["BetweenPlayers"], :]
             )  # Relies on no duplicates see exception below
@@ -1231,16 +1302,10 @@ class AgeMap:
         :param resources_to_identify: List of strings, each of the strings being the name of a tile to process
         """
         # Identify islands (groups) of resources for minin information from later
-        self.resource_labels = [
-            self.identify_islands_of_resources(self.tiles, resource=res)
-            for res in resources_to_identify
-        ]
+        self.resource_labels = self.identify_islands_of_resources(self.tiles, resources=resources_to_identify)
 
-        # Take all the resource labels and merge onto main tiles dataframe
-        for res in self.resource_labels:
-            self.tiles = self.tiles.merge(
-                res.drop(columns=["x", "y"]), on="instance_id", how="left"
-            )
+        # Attach the resource kind and island to the main tiles dataframe - empty for tiles that are not resources
+        self.tiles = self.tiles.join(self.resource_labels[["resource_kind", "island_id"]])
 
         # Flag resources that are in between the players
         # Identify the corners of the corridor between players
@@ -1248,16 +1313,11 @@ class AgeMap:
             self.identify_pathway_between_players()
         )  # List of tuples
 
-        # Apply for each resource - check if it is in polygon
-        list_dfs_of_resources_between_players = [
-            self.identify_resources_or_feature_between_players(
-                map_feature_locations=self.tiles.loc[self.tiles[res] > 0, :],
-                polygon_to_check_within=self.corridor_between_players,
-            )
-            for res in resources_to_identify
-        ]
-
-        df_resources_between_players = pd.concat(list_dfs_of_resources_between_players)
+        # Check if each resource is in polygon - all resources at once
+        df_resources_between_players = self.identify_resources_or_feature_between_players(
+            map_feature_locations=self.tiles.loc[self.tiles["resource_kind"].notna(), :],
+            polygon_to_check_within=self.corridor_between_players,
+        )
 
         # Merge DF of all resources that are between
         self.tiles = self.tiles.merge(
@@ -1333,48 +1393,57 @@ class AgeMap:
         """Identify the # of a map feature between players. Models scenarios such as large forests that units must move around,
         or can identify forward golds"""
         # TODO generalise this to just polygons, so that the sides can be checked for resources
+        from shapely import Polygon, contains_xy  # Imported here so that shapely is only loaded if the map is analysed
+
         poly = Polygon(polygon_to_check_within)
-        locations = map_feature_locations.copy()
-        locations.loc[:, "BetweenPlayers"] = locations.apply(
-            lambda x: Point(
-                x["x"],
-                x["y"],
-            ).within(poly),
-            axis=1,
+        locations = map_feature_locations.loc[:, ["instance_id"]].copy()
+        # Vectorised point in polygon over every location - same as Point(x, y).within(poly) for each
+        locations["BetweenPlayers"] = contains_xy(
+            poly,
+            map_feature_locations["x"].to_numpy(dtype=float),
+            map_feature_locations["y"].to_numpy(dtype=float),
         )
-        return locations.loc[:, ["instance_id", "BetweenPlayers"]]
+        return locations
 
     def identify_islands_of_resources(
-        self, dataframe_of_map: pd.DataFrame, resource: str
+        self, dataframe_of_map: pd.DataFrame, resources: list
     ) -> pd.DataFrame:
-        """Search for islands of resrouces in the 2D image of the map. Label the dataframe of resources with groups found"""
+        """Search for islands of resources in the 2D image of the map. All of the resources are labelled in one pass, each
+        in its own channel of a 3D image so that islands never join across resources (e.g. trees next to a gold mine).
+
+        :param dataframe_of_map: tiles of the map, with name, x, y and instance_id columns
+        :param resources: names of the resources to label
+        :return: the tiles of the resources with their resource_kind (name) and island_id. Islands are numbered from 1
+            separately for each resource, in the order they are found scanning the map
+        :rtype: pd.DataFrame
+        """
         # See some resources: https://stackoverflow.com/questions/46737409/finding-connected-components-in-a-pixel-array
         # https://docs.scipy.org/doc/scipy-0.16.0/reference/generated/scipy.ndimage.measurements.label.html
         # https://docs.scipy.org/doc/scipy/reference/generated/scipy.ndimage.label.html#scipy.ndimage.label
+        from scipy.ndimage import label, generate_binary_structure  # Only loaded if the map is analysed - slow to import
 
-        df = dataframe_of_map[["y", "x", "instance_id", "name"]]  # Reduce columns
+        df = dataframe_of_map.loc[dataframe_of_map["name"].isin(resources), ["name", "x", "y", "instance_id"]]  # Reduce columns
+        df = df.rename(columns={"name": "resource_kind"})
+        channels = pd.Categorical(df["resource_kind"], categories=resources).codes
         # The AOE Game engine starts these objects in the centre of the tile. Remove the decimal if it exists.
-        df.loc[:, ["x", "y"]] = np.floor(df[["x", "y"]].round()).astype(
-            np.int32
-        )  # remove decimal of floats
-        df = df.loc[df["name"] == resource, ["x", "y", "instance_id"]]
-
-        map_of_resources = np.zeros((self.map_size_int, self.map_size_int))
-        for index, row in df.iterrows():
-            # Not the fastest or most pythonic but quickest to write the code
-            map_of_resources[int(row["x"]), int(row["y"])] = 1
-
-        s = generate_binary_structure(
-            2, 2
-        )  # Creates a 3x3 matrix of 1's. Pass as structure to label to allow diagnoal check
+        xs = np.floor(df["x"].round()).to_numpy(dtype=np.intp)
+        ys = np.floor(df["y"].round()).to_numpy(dtype=np.intp)
+        df = df.assign(x=xs, y=ys)
+
+        # Rasterise every tile of every resource onto its channel of the map in one go
+        map_of_resources = np.zeros((len(resources), self.map_size_int, self.map_size_int), dtype=bool)
+        map_of_resources[channels, xs, ys] = True
+
+        # 3x3 matrix of 1's to allow diagonal checks within a channel, and nothing connecting neighbouring channels
+        s = np.zeros((3, 3, 3), dtype=bool)
+        s[1] = generate_binary_structure(2, 2)
         labeled_array, num_features = label(map_of_resources, structure=s)
 
-        for label_index in range(1, num_features + 1):
-            coords = np.where(labeled_array == label_index)
-            for x, y in zip(coords[0], coords[1]):
-                df.loc[(df["x"] == int(x)) & (df["y"] == int(y)), resource] = (
-                    label_index
-                )
+        # Labels are given scanning channel by channel, so each resource's labels follow on from those of the resources
+        # before it. Subtract the last label of the previous channels to number each resource's islands from 1
+        last_label_of_channel = np.maximum.accumulate(labeled_array.reshape(len(resources), -1).max(axis=1))
+        offsets = np.concatenate([[0], last_label_of_channel[:-1]])
+        df["island_id"] = labeled_array[channels, xs, ys] - offsets[channels]
 
         return df
 
@@ -1385,105 +1454,102 @@ class AgeMap:
         player_locations: list,
     ) -> pd.DataFrame:
         """Simply checks the distance from each resource to the players. Takes min distance as the appropriate player.
-        Max distance is to prevent far away resources from being assigned. Should be approx 50% of the distance between players
+        Max distance is to prevent far away resources from being assigned. Should be approx 50% of the distance between players.
+        Works for any number of players (e.g. team games) - a distance column is returned for each player.
 
         :param map_feature_locations: DataFrame with the tiles of interest to assign to each player
         :param maximum_distance_to_player: upper limit to assign a resource to person
-        :param player_locations: tuple of ((x_1, y_1), (x_2,y_2))
-        :return: Collumns of object ID, closest player, and distance to both players
+        :param player_locations: tuple of ((x_1, y_1), (x_2,y_2), ...)
+        :return: Collumns of object ID, closest player, and distance to each player
         :rtype: pd.DataFrame
         """
         # Identify the main resources around a player and assign to that player for further analysis
-        # Distance to player 1 = norm of vecotr: x_resource - x_player, y_resource - y_player
-        map_feature_locations["DistancePlayer1"] = map_feature_locations.apply(
-            lambda row: np.linalg.norm(
-                (row["x"] - player_locations[0][0], row["y"] - player_locations[0][1])
-            ),
-            axis=1,
-        )
-        # Same for location to second player
-        map_feature_locations["DistancePlayer2"] = map_feature_locations.apply(
-            lambda row: np.linalg.norm(
-                (row["x"] - player_locations[1][0], row["y"] - player_locations[1][1])
-            ),
-            axis=1,
-        )
+        from scipy.spatial import distance  # Only loaded if the map is analysed - slow to import
 
-        map_feature_locations["ClosestPlayer"] = map_feature_locations.apply(
-            lambda row: (
-                row[["DistancePlayer1", "DistancePlayer2"]].idxmin()
-                if row[["DistancePlayer1", "DistancePlayer2"]].min()
-                < maximum_distance_to_player
-                else None
-            ),
-            axis=1,
+        # Distance from every resource to every player in one go: matrix of shape (resources, players)
+        distances = distance.cdist(
+            map_feature_locations[["x", "y"]].to_numpy(dtype=float),
+            np.asarray(player_locations, dtype=float),
         )
+        distance_columns = [f"DistancePlayer{index + 1}" for index in range(len(player_locations))]
+        map_feature_locations[distance_columns] = distances
 
-        map_feature_locations["ClosestPlayer"] = map_feature_locations[
-            "ClosestPlayer"
-        ].map({"DistancePlayer1": 1, "DistancePlayer2": 2})
+        # Player numbers start at 1. Resources too far from every player are not assigned (NaN)
+        map_feature_locations["ClosestPlayer"] = np.where(
+            distances.min(axis=1) < maximum_distance_to_player,
+            distances.argmin(axis=1) + 1,
+            np.nan,
+        )
 
-        return map_feature_locations[
-            ["instance_id", "ClosestPlayer", "DistancePlayer1", "DistancePlayer2"]
-        ]
+        return map_feature_locations[["instance_id", "ClosestPlayer"] + distance_columns]
 
 
 class AgeGame:
     """A small wrapper for understanding an AOE game. Should just be a container for the mgz game which I can start to unpack"""
 
-    def __init__(self, path: Path | str) -> None:
+    def __init__(self, path: Path | str, cache: ReplayCache | None = None) -> None:
+        """Parse the game with mgz and set up the map and players for analysis.
+
+        :param path: path to the .aoe2record file
+        :param cache: optional on-disk cache of parsed games. On a cache hit mgz is not run and self.match is None
+        """
         self.path_to_game: Path | str = path
+        self.match = None
+        self.diagnostics = Diagnostics()  # Issues found in the analysis, e.g. units missing from the Enums
 
-        try:
-            with open(self.path_to_game, "rb") as g:
-                self.match = parse_match(g)
-                self.match_json = serialize(self.match)
-        except FileNotFoundError as e:
-            # Tell the user the file was not found
-            raise e
-        except Exception:
-            # From the perspective of this package, fail if the MGZ parser cannot parse the game.
-            # The below error message lets the user know it is an MGZ error, and beyond the scope of this package
-            # In other words, catch any base exceptions raised by MGZ, which are from the perspective of this package,
-            # unknown failure states. Fatally exit in this case
-            raise MGZParserException(path)
-
-        # Raw data from the game
-        self.teams: list = self.match_json[
-            "teams"
-        ]  # Just a list lists with teams and player IDs per team
-        self.rated_game: bool = self.match_json["rated"]  # bool
-        self.game_speed: str = self.match_json["speed"]  # String
-        self.game_data_set: str = self.match_json["dataset"]  # Just DE, not necessary
-        self.starting_age: str = self.match_json[
-            "starting_age"
-        ]  # String, Dark/Fuedal/Castle
-        self.game_duration: str = self.match_json["duration"]  # time HH:MM:SS.XXXXXX
-        self.timestamp: str = self.match_json.get("timestamp", None)  # Datetime, ISO format, if not found None (not consequential)
-        self.actions = self.match_json["actions"]  # JSON format! this is it
-        self.inputs = self.match_json["inputs"]
-
-        # Get features of the map in the AgeMap object
-        # In some instances parser cannot find player positions - they are empty dictionaries
-        # TODO alter API so that this analysis can be turned on or off, and is returned rather found from an attribute
-        self.game_map = AgeMap(
-            map=self.match_json["map"],
-            gaia=self.match_json["gaia"],
-            player_starting_locations=[
-                tuple(self.match_json["players"][0]["position"].values()),
-                tuple(self.match_json["players"][1]["position"].values()),
-            ],
-        )
-        self.player_map_analysis = self.game_map.map_analysis
+        with open(self.path_to_game, "rb") as g:  # Raises FileNotFoundError to tell the user the file was not found
+            replay_bytes = g.read()
+
+        cached_game = None
+        if cache is not None:
+            cache_key = cache.key(replay_bytes)
+            with span("cache_load", replay=str(path)):
+                cached_game = cache.load(cache_key)
 
-        # Transform raw data into usable chunks
-        self.all_inputs_df = pd.json_normalize(self.inputs)
-        self.all_actions_df = pd.json_normalize(self.actions)
+        if cached_game is not None:
+            game_metadata, tables = cached_game
+        else:
+            try:
+                with span("parse", replay=str(path)):
+                    self.match = parse_match(io.BytesIO(replay_bytes))
+                with span("normalise", replay=str(path)):
+                    game_metadata, tables = match_to_tables(self.match)
+            except Exception:
+                # From the perspective of this package, fail if the MGZ parser cannot parse the game.
+                # The below error message lets the user know it is an MGZ error, and beyond the scope of this package
+                # In other words, catch any base exceptions raised by MGZ, which are from the perspective of this package,
+                # unknown failure states. Fatally exit in this case
+                raise MGZParserException(path)
+            if cache is not None:
+                with span("cache_store", replay=str(path)):
+                    cache.store(cache_key, game_metadata, tables)
+
+        # Raw data from the game. Read straight from the mgz model rather than serialising the whole match to JSON
+        self.teams: list = game_metadata["teams"]  # Just a list lists with teams and player IDs per team
+        self.rated_game: bool = game_metadata["rated"]  # bool
+        self.game_speed: str = game_metadata["speed"]  # String
+        self.game_data_set: str = game_metadata["dataset"]  # Just DE, not necessary
+        self.starting_age: str = game_metadata["starting_age"]  # String, Dark/Fuedal/Castle
+        self.game_duration: str = game_metadata["duration"]  # time HH:MM:SS.XXXXXX
+        self.timestamp: str = game_metadata["timestamp"]  # Datetime, ISO format, if not found None (not consequential)
+
+        # List of dictionaries, including civilisations; location;
+        self.players_raw_info: list = game_metadata["players"]
+
+        # The map is only analysed if it is asked for - see game_map
+        self.map_info: dict = game_metadata["map"]
+        self.map_tiles: pd.DataFrame = tables["map_tiles"]
+        self.gaia: pd.DataFrame = tables["gaia"]
+
+        # Transform raw data into usable chunks - typed columnar frames built directly from the mgz model
+        self.all_inputs_df: pd.DataFrame = tables["inputs"]
+        self.all_actions_df: pd.DataFrame = tables["actions"]
+
+        # Split the inputs and actions by player in one pass rather than filtering the whole game for each player
+        inputs_by_player = dict(tuple(self.all_inputs_df.groupby("player", sort=False)))
+        actions_by_player = dict(tuple(self.all_actions_df.groupby("player", sort=False)))
 
         # Store list of players as GamePlayer objects; this stores indivdual data and data mining methods
-        self.players_raw_info = self.match_json[
-            "players"
-        ]  # List of dictionaries, including civilisations; location;
         self.players = [
             GamePlayer(
                 number=player["number"],
@@ -1492,12 +1558,8 @@ class AgeGame:
                 starting_position=player["position"],
                 elo=player.get("rate_snapshot", None),  # sometimes not contained - do not fail, just need to flow on as NoneType
                 winner=player["winner"],
-                actions=self.all_actions_df.loc[
-                    self.all_actions_df["player"] == player["number"], :
-                ],
-                inputs=self.all_inputs_df.loc[
-                    self.all_inputs_df["player"] == player["number"], :
-                ],
+                actions=actions_by_player.get(player["number"], self.all_actions_df.iloc[0:0]),
+                inputs=inputs_by_player.get(player["number"], self.all_inputs_df.iloc[0:0]),
             )
             for player in self.players_raw_info
             if isinstance(player, dict)
@@ -1505,6 +1567,53 @@ class AgeGame:
 
         return
 
+    @staticmethod
+    def metadata_only(path: Path | str) -> pd.Series:
+        """Quick summary of a game - map, duration, whether it was rated, and each player's name, civilisation, Elo and
+        whether they won. Only the header and a skim of the body are read, so this is far faster than creating an AgeGame.
+        Useful to triage a corpus of games before the full analysis.
+
+        :param path: path to the .aoe2record file
+        :return: summary of the game, one entry per statistic
+        :rtype: pd.Series
+        """
+        with open(path, "rb") as g:  # Raises FileNotFoundError to tell the user the file was not found
+            try:
+                summary = replay_summary(g)
+            except Exception:
+                # As with the full parse, any failure to read the file is an MGZ failure from the perspective of this package
+                raise MGZParserException(path)
+
+        game_summary = {
+            "Map": summary["map"],
+            "Duration": pd.Timedelta(summary["duration"]),
+            "Rated": summary["rated"],
+        }
+        for player in summary["players"]:
+            game_summary[f"Player{player['number']}.Name"] = player["name"]
+            game_summary[f"Player{player['number']}.Civilisation"] = player["civilization"]
+            game_summary[f"Player{player['number']}.Elo"] = player["rate_snapshot"]
+            game_summary[f"Player{player['number']}.Winner"] = player["winner"]
+        return pd.Series(game_summary)
+
+    @cached_property
+    def game_map(self) -> AgeMap:
+        """Features of the map in the AgeMap object. Analysing the map is expensive, so it is done on first use"""
+        # In some instances parser cannot find player positions - they are empty dictionaries
+        with span("map", replay=str(self.path_to_game)):
+            return AgeMap(
+                map={**self.map_info, "tiles": self.map_tiles},
+                gaia=self.gaia,
+                player_starting_locations=[
+                    tuple(self.players_raw_info[0]["position"].values()),
+                    tuple(self.players_raw_info[1]["position"].values()),
+                ],
+            )
+
+    @property
+    def player_map_analysis(self) -> pd.Series:
+        return self.game_map.map_analysis
+
     def calculate_distance_between_players(
         self, location_one: tuple, location_two: tuple
     ) -> float:
@@ -1520,58 +1629,82 @@ class AgeGame:
             return player_one.elo - player_two.elo
         return player_two.elo - player_one.elo
 
-    def advanced_parser(self, include_map_analyses: bool = True) -> pd.Series:
+    def advanced_parser(
+        self, include_map_analyses: bool = True, sections: Iterable[str] | None = None
+    ) -> pd.Series:
+        """Analyse the game. Each section is only computed if requested, so callers that need e.g. age up times
+        and civilisations do not pay for the production models or the map analysis.
+
+        :param include_map_analyses: include the "map" section, kept for backwards compatibility
+        :param sections: sections of the analysis to return, any of ANALYSIS_SECTIONS. Defaults to all of them
+        :return: results of the analysis, one entry per statistic
+        :rtype: pd.Series
+        """
         # TODO get the winner from players
         # TODO mine if boar or elephant
+        sections = ANALYSIS_SECTIONS if sections is None else tuple(sections)
+        unknown_sections = set(sections) - set(ANALYSIS_SECTIONS)
+        if unknown_sections:
+            raise ValueError(f"Unknown sections {unknown_sections}, choose from {ANALYSIS_SECTIONS}")
+        player_sections = [section for section in PLAYER_SECTIONS if section in sections]
+
+        with self.diagnostics:
+            # Extract the key statistics / data points
+            # research times to mine out
+            self.game_results = pd.Series()
+
+            # Identify the opening strategy and choices of each player
+            for player in self.players:
+                if player_sections:
+                    with span("player", replay=str(self.path_to_game), player=player.number):
+                        player_opening_strategies = player.full_player_choices_and_strategy(
+                            feudal_time=player.age_up_times[2],
+                            castle_time=player.age_up_times[3],
+                            loom_time=player.technologies["Loom"] if "uptimes" in player_sections else None,
+                            end_of_game=player.end_of_game,
+                            civilisation=player.civilisation,
+                            sections=player_sections,
+                        )
+                else:
+                    player_opening_strategies = pd.Series()
+                player_opening_strategies = player_opening_strategies.add_prefix(
+                    f"Player{player.number}.OpeningStrategy."
+                )
 
-        # Extract the key statistics / data points
-        # research times to mine out
-        self.game_results = pd.Series()
-
-        # Identify the opening strategy and choices of each player
-        for player in self.players:
-            player_opening_strategies = player.full_player_choices_and_strategy(
-                feudal_time=player.age_up_times[2],
-                castle_time=player.age_up_times[3],
-                loom_time=player.technologies["Loom"],
-                end_of_game=player.actions_df["timestamp"].max(),
-                civilisation=player.civilisation
-            )
-            player_opening_strategies = player_opening_strategies.add_prefix(
-                f"Player{player.number}.OpeningStrategy."
-            )
+                location_and_civilisation = pd.concat(
+                    [player.identify_civilisation(), player.identify_location()]
+                )
+                location_and_civilisation = location_and_civilisation.add_prefix(
+                    f"Player{player.number}.MapAndCiv."
+                )
 
-            location_and_civilisation = pd.concat(
-                [player.identify_civilisation(), player.identify_location()]
-            )
-            location_and_civilisation = location_and_civilisation.add_prefix(
-                f"Player{player.number}.MapAndCiv."
-            )
+                self.game_results = pd.concat(
+                    [
+                        self.game_results,
+                        player_opening_strategies,
+                        location_and_civilisation,
+                    ]
+                )
 
-            self.game_results = pd.concat(
-                [
-                    self.game_results,
-                    player_opening_strategies,
-                    location_and_civilisation,
-                ]
+            # Distance between players
+            self.game_results["DistanceBetweenPlayers"] = (
+                self.calculate_distance_between_players(
+                    location_one=self.game_results["Player1.MapAndCiv.StartingLocation"],
+                    location_two=self.game_results["Player2.MapAndCiv.StartingLocation"],
+                )
             )
 
-        # Distance between players
-        self.game_results["DistanceBetweenPlayers"] = (
-            self.calculate_distance_between_players(
-                location_one=self.game_results["Player1.MapAndCiv.StartingLocation"],
-                location_two=self.game_results["Player2.MapAndCiv.StartingLocation"],
-            )
-        )
+            # Elo difference between players - negative is winner is lower elo
+            self.game_results["DifferenceInELO"] = self.calculate_difference_in_elo(
+                player_one=self.players[0], player_two=self.players[1]
+            )  # Currently, if either do not have an elo the difference value returned will be 0
 
-        # Elo difference between players - negative is winner is lower elo
-        self.game_results["DifferenceInELO"] = self.calculate_difference_in_elo(
-            player_one=self.players[0], player_two=self.players[1]
-        )  # Currently, if either do not have an elo the difference value returned will be 0
+            results = self.game_results
+            if include_map_analyses and "map" in sections:
+                results = pd.concat([self.game_results, self.player_map_analysis])
 
-        if include_map_analyses:
-            return pd.concat([self.game_results, self.player_map_analysis])
-        return self.game_results
+        self.diagnostics.log_summary(game=str(self.path_to_game))  # One summary of any issues, rather than one per row
+        return results
 
 
 if __name__ == "__main__":
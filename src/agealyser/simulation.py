@@ -0,0 +1,206 @@
+"""Discrete-event simulation of a player's production buildings. The recorded game only has the inputs - when a unit was
+queued or a technology clicked - so when each was actually completed is worked out by replaying the inputs against a model
+of each building's queue:
+
+- a building produces one item at a time, in the order they were queued
+- a queue command sent with several buildings selected is dispatched one unit at a time to the least busy building
+  (round-robin between buildings that are equally busy), as the game does
+- an unqueue removes the last item of the stack in the queue slot clicked, cancelling it if it is in production
+
+Completions are kept in a heap, so a player's whole game is simulated in O(n log n) for n items (times the number of
+buildings selected per command, which is small).
+"""
+
+import heapq
+import itertools
+from collections import deque
+from typing import Dict, List, Tuple
+
+import numpy as np
+import pandas as pd
+
+from .diagnostics import record
+
+UNIT_COLUMNS = ["event", "building_id", "queued_at", "started_at", "finished_at"]
+BUSY_COLUMNS = ["building_id", "start", "end"]
+
+
+class _BuildingQueue:
+    """State of one building's queue in the simulation"""
+
+    __slots__ = ("queue", "current", "version", "busy_since", "has_queued_units", "last_dispatch")
+
+    def __init__(self) -> None:
+        self.queue = deque()  # units waiting, each the index of its record
+        self.current: int | None = None  # unit in production
+        self.version = 0  # bumped when the unit in production is cancelled, so its completion is ignored
+        self.busy_since: int | None = None
+        self.has_queued_units = False
+        self.last_dispatch = -1
+
+    @property
+    def load(self) -> int:
+        return len(self.queue) + (self.current is not None)
+
+
+class ProductionSimulator:
+    """Simulates the queues of all of a player's production buildings at once. Feed it inputs in time order with order
+    and unqueue, then call finish. Times are int64 nanoseconds of game time."""
+
+    def __init__(self) -> None:
+        self.buildings: Dict[int, _BuildingQueue] = {}
+        self._completions: List[Tuple[int, int, int, int]] = []  # heap of (finish time, tiebreak, building, version)
+        self._tiebreak = itertools.count()
+        self._dispatches = itertools.count()
+        # One record per unit dispatched: [event, building, queued_at, started_at, finished_at, duration, item]
+        self.units: List[list] = []
+        self.busy_intervals: List[Tuple[int, int, int]] = []
+
+    def building(self, building_id: int) -> _BuildingQueue:
+        if building_id not in self.buildings:
+            self.buildings[building_id] = _BuildingQueue()
+        return self.buildings[building_id]
+
+    def advance(self, time: float) -> None:
+        """Complete every unit finished by time, starting the next unit in each building's queue"""
+        while self._completions and self._completions[0][0] <= time:
+            finished_at, _, building_id, version = heapq.heappop(self._completions)
+            building = self.buildings[building_id]
+            if version != building.version:
+                continue  # The unit was cancelled
+            self.units[building.current][4] = finished_at
+            building.current = None
+            self._start_next(building_id, building, finished_at)
+
+    def _start_next(self, building_id: int, building: _BuildingQueue, time: int) -> None:
+        if not building.queue:
+            if building.busy_since is not None and time > building.busy_since:
+                self.busy_intervals.append((building_id, building.busy_since, time))
+            building.busy_since = None
+            return
+        unit = building.queue.popleft()
+        building.current = unit
+        if building.busy_since is None:
+            building.busy_since = time
+        self.units[unit][3] = time
+        heapq.heappush(
+            self._completions, (time + self.units[unit][5], next(self._tiebreak), building_id, building.version)
+        )
+
+    def order(
+        self,
+        time: int,
+        event: int,
+        item: str,
+        duration: int,
+        building_ids: List[int],
+        amount: int = 1,
+        unit: bool = True,
+    ) -> None:
+        """Queue amount of an item (unit or technology) taking duration, dispatching each to the least busy of the
+        selected buildings. event identifies the input in the results"""
+        if not building_ids:
+            return
+        self.advance(time)
+        buildings = [(building_id, self.building(building_id)) for building_id in building_ids]
+        for _ in range(amount):
+            # Least busy building, round-robin between equally busy ones (min keeps the first on a tie)
+            building_id, building = min(buildings, key=lambda b: (b[1].load, b[1].last_dispatch))
+            building.last_dispatch = next(self._dispatches)
+            building.has_queued_units |= unit
+            self.units.append([event, building_id, time, None, None, duration, item])
+            building.queue.append(len(self.units) - 1)
+            if building.current is None:
+                self._start_next(building_id, building, time)
+
+    def unqueue(self, time: int, building_id: int, slot: int) -> None:
+        """Remove the last item of the stack of identical items in the queue slot clicked"""
+        self.advance(time)
+        building = self.buildings.get(building_id)
+        if building is None or not building.has_queued_units:
+            # Without any units queued the queue is not fully known (e.g. mgz could not read the queue commands), so the
+            # slot cannot be matched - removing a technology instead would throw its time off
+            record("unqueue_not_applied", "no units queued in building")
+            return
+
+        items = ([building.current] if building.current is not None else []) + list(building.queue)
+        # Stacks of consecutive identical items, as shown in the game's queue - [start, end) positions in items
+        stacks = []
+        for position, unit in enumerate(items):
+            if stacks and self.units[items[stacks[-1][0]]][6] == self.units[unit][6]:
+                stacks[-1][1] = position + 1
+            else:
+                stacks.append([position, position + 1])
+        if slot >= len(stacks):
+            record("unqueue_not_applied", "queue slot is empty in the model")
+            return
+
+        last_of_stack = stacks[slot][1] - 1
+        if building.current is not None and last_of_stack == 0:
+            # Cancel the unit in production and start the next
+            building.version += 1
+            building.current = None
+            self._start_next(building_id, building, time)
+        else:
+            del building.queue[last_of_stack - (building.current is not None)]
+
+    def finish(self) -> Tuple[pd.DataFrame, pd.DataFrame]:
+        """Complete everything still queued
+
+        :return: tuple of (units, busy intervals). Units has a row per unit dispatched to a building, in the order they
+            were dispatched, with the event that queued it and timedelta queued_at, started_at and finished_at (NaT if
+            cancelled). Busy intervals has a row per period a building was producing without a break
+        :rtype: Tuple[pd.DataFrame, pd.DataFrame]
+        """
+        self.advance(float("inf"))
+        not_a_time = np.iinfo(np.int64).min  # NaT as int64
+
+        def timedeltas(values: list) -> np.ndarray:
+            return np.array(
+                [not_a_time if value is None else value for value in values], dtype=np.int64
+            ).view("timedelta64[ns]")
+
+        units = pd.DataFrame(
+            {
+                "event": np.array([unit[0] for unit in self.units], dtype=np.int64),
+                "building_id": [unit[1] for unit in self.units],
+                "queued_at": timedeltas([unit[2] for unit in self.units]),
+                "started_at": timedeltas([unit[3] for unit in self.units]),
+                "finished_at": timedeltas([unit[4] for unit in self.units]),
+            },
+            columns=UNIT_COLUMNS,
+        )
+        busy = pd.DataFrame(
+            {
+                "building_id": [interval[0] for interval in self.busy_intervals],
+                "start": timedeltas([interval[1] for interval in self.busy_intervals]),
+                "end": timedeltas([interval[2] for interval in self.busy_intervals]),
+            },
+            columns=BUSY_COLUMNS,
+        )
+        return units, busy
+
+
+def simulate_production(events: pd.DataFrame) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    """Simulate production buildings over a player's inputs.
+
+    :param events: one row per input in time order, with columns timestamp (timedelta), type (Queue, Research, Unqueue),
+        param (the item queued), duration (int64 nanoseconds to produce the item), buildings (list of the IDs of the
+        buildings selected that can produce the item, or that are unqueued from), amount (number of units queued) and
+        slot (queue slot unqueued)
+    :return: tuple of (units, busy intervals) - see ProductionSimulator.finish. A unit's event is the position of its
+        input in events
+    :rtype: Tuple[pd.DataFrame, pd.DataFrame]
+    """
+    simulator = ProductionSimulator()
+    times = events["timestamp"].to_numpy(dtype="timedelta64[ns]").view(np.int64)
+    columns = ["type", "param", "duration", "buildings", "amount", "slot"]
+    for event, (time, (input_type, item, duration, building_ids, amount, slot)) in enumerate(
+        zip(times.tolist(), events[columns].itertuples(index=False, name=None))
+    ):
+        if input_type == "Unqueue":
+            if building_ids:
+                simulator.unqueue(time, building_ids[0], int(slot))
+        else:
+            simulator.order(time, event, item, int(duration), building_ids, int(amount), unit=input_type == "Queue")
+    return simulator.finish()
@@ -1,16 +1,20 @@
+import numpy as np
 import pandas as pd
 import logging
 import warnings
 
 from abc import ABC, abstractmethod
+from typing import Dict, Iterable, List, Tuple
 
+from agealyser.diagnostics import record
+from agealyser.ingest import intern_object_ids
+from agealyser.instrumentation import span
+from agealyser.simulation import simulate_production
 from agealyser.agealyser_enums import (  # Getting a bit too cute here with constants but it will do for now
-    UnitCreationTime,
-    ArcheryRangeUnits,
-    BarracksUnits,
-    StableUnits,
-    SiegeWorkshopUnits,
-    TownCentreUnitsAndTechs,
+    BUILD_TIMES,
+    UNIT_CREATION_TIMES,
+    TimingTable,
+    ProductionBuildingUnits,
 )
 
 logger = logging.getLogger(__name__)
@@ -36,18 +40,121 @@ class AgeAlyserAnalysisError(Exception):
         super().__init__(self.message, *args)
 
 
+def dedupe_inputs(
+    inputs: pd.DataFrame,
+    window: pd.Timedelta = pd.Timedelta(seconds=0.25),
+    cutoff: pd.Timedelta = pd.Timedelta(seconds=20),
+) -> pd.DataFrame:
+    """Remove duplicated Queue inputs. Records are sometimes duplicated by the game around 0.2s apart - a Queue is
+    dropped if it is the same type, param and object IDs as the input before it, within the window.
+
+    :param inputs: a player's inputs, in order
+    :param window: maximum time between duplicated inputs
+    :param cutoff: only inputs after this time are checked - e.g. players often queue several villagers at the start
+    :return: inputs with the duplicates removed
+    :rtype: pd.DataFrame
+    """
+    if "object_ids_key" in inputs.columns:
+        object_ids_key = inputs["object_ids_key"].to_numpy()
+    else:
+        object_ids_key = intern_object_ids(inputs["payload.object_ids"]).to_numpy()
+
+    # Compare each input to the one before with integer codes. Missing values (-1) never equal one another, as in pandas
+    same_as_previous = np.zeros(len(inputs), dtype=bool)
+    same_as_previous[1:] = True
+    for codes in [pd.factorize(inputs["type"])[0], pd.factorize(inputs["param"])[0], object_ids_key]:
+        same_as_previous[1:] &= (codes[1:] == codes[:-1]) & (codes[1:] >= 0)
+
+    timestamps = inputs["timestamp"].to_numpy(dtype="timedelta64[ns]").view(np.int64)
+    within_window = np.zeros(len(inputs), dtype=bool)
+    within_window[1:] = np.diff(timestamps) < window.value
+
+    duplicated = (
+        same_as_previous
+        & within_window
+        & (timestamps > cutoff.value)
+        & (inputs["type"] == "Queue").to_numpy()  # remove anything that is not Queue after
+    )
+    return inputs.loc[~duplicated]
+
+
+def unit_creation_times(
+    units: pd.Series, units_production_times: TimingTable, civilisation: str | None = None
+) -> np.ndarray:
+    """Time each unit takes to create, as int64 nanoseconds. Each unit is looked up once rather than for every row
+
+    :param units: names of the units, with whitespace and hyphens replaced by underscores
+    :param units_production_times: table of creation times
+    :param civilisation: the player's civilisation, for its overrides of the creation times
+    :return: int64 array of creation times
+    """
+    unique_units = pd.unique(units.dropna())  # e.g. unqueues have no unit
+    unit_times = units_production_times.lookup(unique_units, civilisation=civilisation)
+    creation_times = {}
+    for unit, unit_time in zip(unique_units, unit_times):
+        if np.isnan(unit_time):
+            units_production_times.has_value(unit)  # Enum records the unit in the diagnostics, and it is treated as instant
+            creation_times[unit] = 0
+            continue
+        creation_times[unit] = pd.Timedelta(seconds=unit_time).value
+    return units.map(creation_times).fillna(0).to_numpy(dtype=np.int64)
+
+
+def villagers_building(object_ids: pd.Series) -> pd.Series:
+    """Number of villagers building each building - the payload.object_ids of its Build input. When MGZ cannot find
+    them, assume 1 villager"""
+    return object_ids.str.len().fillna(1).astype(np.int64)
+
+
+def construction_time(build_times: pd.Series, number_of_villagers: pd.Series) -> pd.Series:
+    """Time to construct each building. Each extra villager speeds up the construction by less, 3t / (n + 2)
+
+    :param build_times: seconds to build each building with one villager (see BUILD_TIMES)
+    :param number_of_villagers: villagers building each building (see villagers_building)
+    :return: timedeltas, with the index of build_times
+    """
+    return pd.to_timedelta((3 * build_times) / (number_of_villagers + 2), unit="s")
+
+
+def busy_time_until(times: np.ndarray, starts: np.ndarray, ends: np.ndarray) -> np.ndarray:
+    """Total length of the disjoint, ordered intervals (e.g. ProductionBuilding.busy_intervals) before each of times
+
+    :param times: int64 array of times
+    :param starts: int64 array of the start of each interval
+    :param ends: int64 array of the end of each interval
+    :return: int64 array of the time covered by the intervals before each of times
+    """
+    if len(starts) == 0:
+        return np.zeros(len(times), dtype=np.int64)
+    covered_before = np.concatenate([[0], np.cumsum(ends - starts)])
+    # The last interval started by each time - every interval before it has ended
+    last_started = np.searchsorted(starts, times, side="right") - 1
+    clipped = np.maximum(last_started, 0)
+    within_last = np.minimum(times, ends[clipped]) - starts[clipped]
+    return np.where(last_started >= 0, covered_before[clipped] + within_last, 0)
+
+
 class ProductionBuilding(ABC):
     """This abstract base class models the function of a production building, including:
     - creating units, - storing upgrades, - measuring idle time"""
 
     @abstractmethod
-    def produce_units(self, data: pd.DataFrame, units_production_enum) -> pd.DataFrame:
+    def produce_units(
+        self, data: pd.DataFrame, units_production_times: TimingTable, civilisation: str | None = None
+    ) -> pd.DataFrame:
         """Take the time stamps of units, as well as the upgrades, and work out when they wouldve been produced,
         taking into account 1 at a time creation (i.e., queuing)
 
+        The result, and the periods the building was busy in the same simulation, are kept so the building is only
+        simulated once. Buildings made by ProductionEngine are given the results of simulating all of the player's
+        buildings at once, which are the same as simulating each on its own
+
         :return pd.DataFrame: a dataframe of units and when they were created
 
         """
+        if self._produced is not None:
+            return self._produced
+
         # TODO - add in upgrades before this
         # self.apply_unit_upgrades()  # call this method first, so that below works, and that produce_units() is only main call
 
@@ -57,57 +164,110 @@ class ProductionBuilding(ABC):
                 f"Missing a column from data in Production Building.\nCols: {data.columns}"
             )
 
-        # coerce timestamp to time delta
-        data["timestamp"] = pd.to_timedelta(data["timestamp"])
+        # only parse timestamps if they are not already timedeltas (e.g. from csv)
+        timestamps = data["timestamp"]
+        if not pd.api.types.is_timedelta64_dtype(timestamps):
+            timestamps = pd.to_timedelta(timestamps)
 
         # string process unit names to remove whitespace
-        data["param"] = data["param"].str.replace(r"-|\s", "_", regex=True)
-
-        # error handling
-        for unit in pd.unique(data["param"]):
-            if not units_production_enum.has_value(unit):
-                # Enum will handle errors if required - otherwise just warn user
-                logger.error(f"Unit could not be found in Enums. Unit was: {unit}")
-
-        # identify start times of all relevant units
-        data["CreationTime"] = data["param"].apply(
-            lambda x: pd.Timedelta(
-                seconds=units_production_enum.get(name=x, civilisation="")
-            )
-        )  # TODO add civ to this object
-        data["UnitCreatedTimestamp"] = data["timestamp"] + data["CreationTime"]
-        data.reset_index(inplace=True)
+        units = data["param"].str.replace(r"-|\s", "_", regex=True)
+
+        # If queued during creation of previous unit, then push out times, and apply unqueues - see simulation
+        events = pd.DataFrame(
+            {
+                "timestamp": timestamps.to_numpy(),
+                "type": data["type"].astype(object).to_numpy() if "type" in data.columns else "Queue",
+                "param": units.to_numpy(),
+                "duration": unit_creation_times(units, units_production_times, civilisation),
+                "buildings": [[self.id]] * len(data),
+                "amount": data.get("payload.amount", pd.Series(1, index=data.index)).fillna(1).to_numpy(),
+                "slot": data.get("payload.slot_id", pd.Series(0, index=data.index)).fillna(0).to_numpy(),
+            }
+        )
+        produced, busy = simulate_production(events)
+        self._produced = self.units_produced(produced, units.to_numpy())
+        self._busy = self.busy_periods(busy)
+        return self._produced
 
-        # Iterate through units. If queued during creation of previous unit, then push out times
-        for index, row in data.iterrows():
-            if index == 0:  # skip first unit
-                continue
-            if (
-                pd.Timedelta(row["timestamp"])
-                < data.loc[index - 1, "UnitCreatedTimestamp"]
-            ):
-                data.loc[index, "UnitCreatedTimestamp"] += (
-                    data.loc[index - 1, "UnitCreatedTimestamp"] - row["timestamp"]
-                )
-                data.loc[index, "timestamp"] += (
-                    data.loc[index - 1, "UnitCreatedTimestamp"] - row["timestamp"]
-                )
+    @staticmethod
+    def units_produced(simulated_units: pd.DataFrame, units: np.ndarray) -> pd.DataFrame:
+        """Units completed in a simulation (see simulation), leaving out cancelled units
 
-        # sort table
-        # maybe iterate through is simplest - if start_above + creation_time_above > start_time
-        # then start_time = start_above + creation_time_above
-        # problem - distribution of units across buildings?? way to differentiate?
+        :param simulated_units: units of ProductionSimulator.finish
+        :param units: name of the unit of each event in the simulation
+        """
+        produced = simulated_units.loc[simulated_units["finished_at"].notna()]
+        return pd.DataFrame(
+            {
+                "param": units[produced["event"].to_numpy()],
+                "UnitCreatedTimestamp": produced["finished_at"].to_numpy(),
+                "UnitStartedTimestamp": produced["started_at"].to_numpy(),
+            }
+        )
 
-        return data[["param", "UnitCreatedTimestamp"]]
+    @staticmethod
+    def busy_periods(simulated_busy: pd.DataFrame) -> pd.DataFrame:
+        """Periods a building was producing in a simulation (see simulation), in order
+
+        :param simulated_busy: busy intervals of ProductionSimulator.finish, of one building
+        """
+        return simulated_busy[["start", "end"]].reset_index(drop=True)
 
     @abstractmethod
     def apply_unit_upgrades(self) -> pd.DataFrame:
         """Method for finding when units have been upgraded. Requires coupling with player technologies"""
         pass
 
+    def busy_intervals(self) -> pd.DataFrame:
+        """Periods the building was producing without a break, as simulated with its units (see produce_units). This
+        includes the time spent on units that were cancelled while in production
+
+        :return: dataframe of disjoint start and end timedeltas, in order
+        :rtype: pd.DataFrame
+        """
+        self.produce_units()  # Simulates the building, if it has not been already
+        return self._busy
+
+    def busy_time(self, times: pd.TimedeltaIndex | List[pd.Timedelta]) -> np.ndarray:
+        """Seconds the building spent producing before each of times"""
+        intervals = self.busy_intervals()
+        return (
+            busy_time_until(
+                pd.TimedeltaIndex(times).to_numpy(dtype="timedelta64[ns]").view(np.int64),
+                intervals["start"].to_numpy().view(np.int64),
+                intervals["end"].to_numpy().view(np.int64),
+            )
+            / 1e9
+        )
+
     @abstractmethod
-    def count_building_idle_time(self) -> int:
-        pass
+    def count_building_idle_time(self, start: pd.Timedelta, end: pd.Timedelta) -> float:
+        """Seconds the building was not producing anything between start and end, counted from when it was completed
+
+        :param start: start of the period, e.g. the start of the game
+        :param end: end of the period, e.g. the time a player reached Feudal Age
+        :return: idle time in seconds
+        :rtype: float
+        """
+        if self.built_at is not None:
+            start = max(start, self.built_at)
+        if end <= start:
+            return 0.0
+        busy_before_start, busy_before_end = self.busy_time([start, end])
+        return (end - start).total_seconds() - (busy_before_end - busy_before_start)
+
+    def utilisation_timeline(self, end: pd.Timedelta, freq: pd.Timedelta = pd.Timedelta(minutes=1)) -> pd.Series:
+        """Fraction of each period of the game the building spent producing, from the period it was completed in
+
+        :param end: end of the timeline, e.g. the end of the game
+        :param freq: length of each period
+        :return: utilisation between 0 and 1, indexed by the start of each period
+        :rtype: pd.Series
+        """
+        start = max(self.built_at, pd.Timedelta(0)) if self.built_at is not None else pd.Timedelta(0)
+        edges = pd.timedelta_range(start=start.floor(freq), end=max(end, start) + freq, freq=freq)
+        busy = np.diff(self.busy_time(edges))
+        return pd.Series(busy / freq.total_seconds(), index=edges[:-1], name="utilisation")
 
     @property
     @abstractmethod
@@ -144,6 +304,11 @@ class ProductionBuilding(ABC):
     def player(self):
         return self._player
 
+    @property
+    @abstractmethod
+    def built_at(self):
+        return self._built_at  # When the building was completed, i.e. placed plus its construction. None if not known
+
 
 class Barracks(ProductionBuilding):
     def __init__(
@@ -155,6 +320,10 @@ class Barracks(ProductionBuilding):
         y: float,
         data: pd.DataFrame,
         player: int,
+        built_at: pd.Timedelta | None = None,
+        produced: pd.DataFrame | None = None,
+        busy: pd.DataFrame | None = None,
+        civilisation: str | None = None,
     ) -> None:
         self._building_type = building_type
         self._units = units
@@ -163,15 +332,19 @@ class Barracks(ProductionBuilding):
         self._y = y
         self._data = data
         self._player = player
+        self._built_at = built_at
+        self._produced = produced  # Units produced, if already simulated (e.g. by ProductionEngine) - see produce_units
+        self._busy = busy  # Periods it was busy in the same simulation
+        self._civilisation = civilisation  # For the civilisation's unit creation times
 
     def produce_units(self) -> pd.DataFrame:
-        return super().produce_units(self._data, UnitCreationTime)
+        return super().produce_units(self._data, UNIT_CREATION_TIMES, self._civilisation)
 
     def apply_unit_upgrades(self) -> pd.DataFrame:
         return super().apply_unit_upgrades()
 
-    def count_building_idle_time(self) -> int:
-        return super().count_building_idle_time()
+    def count_building_idle_time(self, start: pd.Timedelta, end: pd.Timedelta) -> float:
+        return super().count_building_idle_time(start, end)
 
     @property
     def building_type(self):
@@ -201,6 +374,10 @@ class Barracks(ProductionBuilding):
     def player(self):
         return self._player
 
+    @property
+    def built_at(self):
+        return self._built_at
+
 
 class ArcheryRange(ProductionBuilding):
     def __init__(
@@ -212,6 +389,10 @@ class ArcheryRange(ProductionBuilding):
         y: float,
         data: pd.DataFrame,
         player: int,
+        built_at: pd.Timedelta | None = None,
+        produced: pd.DataFrame | None = None,
+        busy: pd.DataFrame | None = None,
+        civilisation: str | None = None,
     ) -> None:
         self._building_type = building_type
         self._units = units
@@ -220,15 +401,19 @@ class ArcheryRange(ProductionBuilding):
         self._y = y
         self._data = data
         self._player = player
+        self._built_at = built_at
+        self._produced = produced  # Units produced, if already simulated (e.g. by ProductionEngine) - see produce_units
+        self._busy = busy  # Periods it was busy in the same simulation
+        self._civilisation = civilisation  # For the civilisation's unit creation times
 
     def produce_units(self) -> pd.DataFrame:
-        return super().produce_units(self._data, UnitCreationTime)
+        return super().produce_units(self._data, UNIT_CREATION_TIMES, self._civilisation)
 
     def apply_unit_upgrades(self) -> pd.DataFrame:
         return super().apply_unit_upgrades()
 
-    def count_building_idle_time(self) -> int:
-        return super().count_building_idle_time()
+    def count_building_idle_time(self, start: pd.Timedelta, end: pd.Timedelta) -> float:
+        return super().count_building_idle_time(start, end)
 
     @property
     def building_type(self):
@@ -258,6 +443,10 @@ class ArcheryRange(ProductionBuilding):
     def player(self):
         return self._player
 
+    @property
+    def built_at(self):
+        return self._built_at
+
 
 class Stable(ProductionBuilding):
     def __init__(
@@ -269,6 +458,10 @@ class Stable(ProductionBuilding):
         y: float,
         data: pd.DataFrame,
         player: int,
+        built_at: pd.Timedelta | None = None,
+        produced: pd.DataFrame | None = None,
+        busy: pd.DataFrame | None = None,
+        civilisation: str | None = None,
     ) -> None:
         self._building_type = building_type
         self._units = units
@@ -277,15 +470,19 @@ class Stable(ProductionBuilding):
         self._y = y
         self._data = data
         self._player = player
+        self._built_at = built_at
+        self._produced = produced  # Units produced, if already simulated (e.g. by ProductionEngine) - see produce_units
+        self._busy = busy  # Periods it was busy in the same simulation
+        self._civilisation = civilisation  # For the civilisation's unit creation times
 
     def produce_units(self) -> pd.DataFrame:
-        return super().produce_units(self._data, UnitCreationTime)
+        return super().produce_units(self._data, UNIT_CREATION_TIMES, self._civilisation)
 
     def apply_unit_upgrades(self) -> pd.DataFrame:
         return super().apply_unit_upgrades()
 
-    def count_building_idle_time(self) -> int:
-        return super().count_building_idle_time()
+    def count_building_idle_time(self, start: pd.Timedelta, end: pd.Timedelta) -> float:
+        return super().count_building_idle_time(start, end)
 
     @property
     def building_type(self):
@@ -315,6 +512,10 @@ class Stable(ProductionBuilding):
     def player(self):
         return self._player
 
+    @property
+    def built_at(self):
+        return self._built_at
+
 
 class SiegeWorkshop(ProductionBuilding):
     def __init__(
@@ -326,6 +527,10 @@ class SiegeWorkshop(ProductionBuilding):
         y: float,
         data: pd.DataFrame,
         player: int,
+        built_at: pd.Timedelta | None = None,
+        produced: pd.DataFrame | None = None,
+        busy: pd.DataFrame | None = None,
+        civilisation: str | None = None,
     ) -> None:
         self._building_type = building_type
         self._units = units
@@ -334,15 +539,19 @@ class SiegeWorkshop(ProductionBuilding):
         self._y = y
         self._data = data
         self._player = player
+        self._built_at = built_at
+        self._produced = produced  # Units produced, if already simulated (e.g. by ProductionEngine) - see produce_units
+        self._busy = busy  # Periods it was busy in the same simulation
+        self._civilisation = civilisation  # For the civilisation's unit creation times
 
     def produce_units(self) -> pd.DataFrame:
-        return super().produce_units(self._data, UnitCreationTime)
+        return super().produce_units(self._data, UNIT_CREATION_TIMES, self._civilisation)
 
     def apply_unit_upgrades(self) -> pd.DataFrame:
         return super().apply_unit_upgrades()
 
-    def count_building_idle_time(self) -> int:
-        return super().count_building_idle_time()
+    def count_building_idle_time(self, start: pd.Timedelta, end: pd.Timedelta) -> float:
+        return super().count_building_idle_time(start, end)
 
     @property
     def building_type(self):
@@ -372,6 +581,10 @@ class SiegeWorkshop(ProductionBuilding):
     def player(self):
         return self._player
 
+    @property
+    def built_at(self):
+        return self._built_at
+
 
 class TownCentre(ProductionBuilding):
     def __init__(
@@ -383,6 +596,10 @@ class TownCentre(ProductionBuilding):
         y: float,
         data: pd.DataFrame,
         player: int,
+        built_at: pd.Timedelta | None = None,
+        produced: pd.DataFrame | None = None,
+        busy: pd.DataFrame | None = None,
+        civilisation: str | None = None,
     ) -> None:
         self._building_type = building_type
         self._units = units  # Include techs like Loom, Wheelbarrow, etc.
@@ -391,16 +608,20 @@ class TownCentre(ProductionBuilding):
         self._y = y
         self._data = data
         self._player = player
+        self._built_at = built_at
+        self._produced = produced  # Units produced, if already simulated (e.g. by ProductionEngine) - see produce_units
+        self._busy = busy  # Periods it was busy in the same simulation
+        self._civilisation = civilisation  # For the civilisation's unit creation times
 
     def produce_units(self) -> pd.DataFrame:
-        return super().produce_units(self._data, UnitCreationTime)
+        return super().produce_units(self._data, UNIT_CREATION_TIMES, self._civilisation)
 
     def apply_unit_upgrades(self) -> pd.DataFrame:
         """Boiler plate should never be called"""
         return super().apply_unit_upgrades()
 
-    def count_building_idle_time(self) -> int:
-        return super().count_building_idle_time()
+    def count_building_idle_time(self, start: pd.Timedelta, end: pd.Timedelta) -> float:
+        return super().count_building_idle_time(start, end)
 
     @property
     def building_type(self):
@@ -430,276 +651,370 @@ class TownCentre(ProductionBuilding):
     def player(self):
         return self._player
 
+    @property
+    def built_at(self):
+        return self._built_at
 
-class AbstractProductionBuildingFactory(ABC):
-    """This Factory solves the complex problem of identifying production buildings in the input data and creating the correct
-    Production Building Object, with its type, location, and, critically, its ID!
-    In brief, because of the structure of the input data, we need to get the ID from the first unit created there,
-    but IDs cannot be re-used.
-    """
-
-    @abstractmethod
-    def factory_method(self):
-        pass
-
-    @abstractmethod
-    def create_production_building_and_remove_used_id(
-        self, building_type: str, units: list, inputs_data: pd.DataFrame, player: int
-    ):
-        """Identify all the Production Buildings and Create them"""
-        relevent_buildings_produced = inputs_data.loc[
-            (inputs_data["param"] == building_type) & (inputs_data["type"] == "Build")
-        ]
-        if relevent_buildings_produced.empty:
-            # TODO handle when it should not create the object; log m
-            return None
-
-        relevent_buildings_produced = relevent_buildings_produced[
-            ["timestamp", "payload.object_ids", "param", "position.x", "position.y"]
-        ]
-
-        relevent_units_queued = inputs_data.loc[
-            inputs_data["param"].isin(units)
-        ]  # 24 Jan note units now includes TECHNOLOGIES
-
-        # Discovery - the payload object IDs are the buildings queued in. This is a list of buildings
-        # so - split them up by building and assign accordingly.
-        all_units_all_buildings = pd.get_dummies(
-            relevent_units_queued["payload.object_ids"].explode()
-        )
-        building_ids = all_units_all_buildings.columns
-        relevent_units_queued = relevent_units_queued.join(all_units_all_buildings)
-
-        first_appearance_of_each_building = relevent_buildings_produced.groupby(
-            ["position.x", "position.y"], as_index=False
-        ).min()
-        dataframe_to_marry_up_to_production = first_appearance_of_each_building[
-            ["timestamp", "payload.object_ids"]
-        ]
-
-        # get x and y coords of buildings
-        df_to_return = pd.concat(
-            [
-                relevent_buildings_produced.reset_index(drop=True),
-                dataframe_to_marry_up_to_production["timestamp"].reset_index(drop=True),
-            ],
-            axis=1,
-        )
-        buildings_used = len(building_ids)
-        df_to_return = df_to_return.loc[
-            0 : buildings_used - 1, :
-        ]  # remove unused buildigns
-        if len(df_to_return.index) < buildings_used:
-            logger.warning(
-                "Producing from more buildings than have created! TODO log what game this is"
-            )  # TODO log what game is this
-            df_to_return.index = building_ids.sort_values()[0 : len(df_to_return)]
-        else:
-            df_to_return.index = building_ids.sort_values()
-
-        # if - else handles buildings that never make units
-        return [
-            (
-                self.factory_method(
-                    building_type,
-                    id=index,
-                    x=x["position.x"],
-                    y=x["position.y"],
-                    data=relevent_units_queued.loc[
-                        relevent_units_queued[index], ["timestamp", "type", "param"]
-                    ],
-                    player=player,
-                )
-                if index in relevent_units_queued.columns
-                else None
-            )
-            for index, x in df_to_return.iterrows()
-        ]
 
+class TrainingBuilding(ProductionBuilding):
+    """Production building that only needs the base model, configured by its building type and units (see
+    ProductionBuildingUnits) - used for every type without a class of its own, e.g. the Castle, Dock and Monastery"""
 
-class BarracksProductionBuildingFactory(AbstractProductionBuildingFactory):
-    def factory_method(
+    def __init__(
         self,
         building_type: str,
+        units: list,
         id: int,
         x: float,
         y: float,
         data: pd.DataFrame,
         player: int,
-    ) -> ProductionBuilding:
-        return Barracks(
-            building_type=building_type,
-            units=BarracksUnits,
-            id=id,
-            x=x,
-            y=y,
-            data=data,
-            player=player,
-        )
+        built_at: pd.Timedelta | None = None,
+        produced: pd.DataFrame | None = None,
+        busy: pd.DataFrame | None = None,
+        civilisation: str | None = None,
+    ) -> None:
+        self._building_type = building_type
+        self._units = units
+        self._id = id
+        self._x = x
+        self._y = y
+        self._data = data
+        self._player = player
+        self._built_at = built_at
+        self._produced = produced  # Units produced, if already simulated (e.g. by ProductionEngine) - see produce_units
+        self._busy = busy  # Periods it was busy in the same simulation
+        self._civilisation = civilisation  # For the civilisation's unit creation times
 
-    def create_production_building_and_remove_used_id(
-        self, inputs_data: pd.DataFrame, player: int
-    ):
-        return super().create_production_building_and_remove_used_id(
-            "Barracks", BarracksUnits, inputs_data, player=player
-        )
+    def produce_units(self) -> pd.DataFrame:
+        return super().produce_units(self._data, UNIT_CREATION_TIMES, self._civilisation)
 
+    def apply_unit_upgrades(self) -> pd.DataFrame:
+        return super().apply_unit_upgrades()
 
-class ArcheryRangeProductionBuildingFactory(AbstractProductionBuildingFactory):
-    def factory_method(
-        self,
-        building_type: str,
-        id: int,
-        x: float,
-        y: float,
-        data: pd.DataFrame,
-        player: int,
-    ) -> ProductionBuilding:
-        return ArcheryRange(
-            building_type=building_type,
-            units=ArcheryRangeUnits,
-            id=id,
-            x=x,
-            y=y,
-            data=data,
-            player=player,
-        )
+    def count_building_idle_time(self, start: pd.Timedelta, end: pd.Timedelta) -> float:
+        return super().count_building_idle_time(start, end)
 
-    def create_production_building_and_remove_used_id(
-        self, inputs_data: pd.DataFrame, player: int
-    ):
-        return super().create_production_building_and_remove_used_id(
-            "Archery Range", ArcheryRangeUnits, inputs_data, player=player
-        )
+    @property
+    def building_type(self):
+        return self._building_type  # string type
 
+    @property
+    def units(self):
+        return self._units  # CONST list of units
 
-class StableProductionBuildingFactory(AbstractProductionBuildingFactory):
-    def factory_method(
-        self,
-        building_type: str,
-        id: int,
-        x: float,
-        y: float,
-        data: pd.DataFrame,
-        player: int,
-    ) -> ProductionBuilding:
-        return Stable(
-            building_type=building_type,
-            units=StableUnits,
-            id=id,
-            x=x,
-            y=y,
-            data=data,
-            player=player,
-        )
+    @property
+    def id(self):
+        return self._id  # Building's ID
 
-    def create_production_building_and_remove_used_id(
-        self, inputs_data: pd.DataFrame, player: int
-    ):
-        return super().create_production_building_and_remove_used_id(
-            "Stable", StableUnits, inputs_data, player
-        )
+    @property
+    def x(self):
+        return self._x
 
+    @property
+    def y(self):
+        return self._y
 
-class SiegeWorkshopProductionBuildingFactory(AbstractProductionBuildingFactory):
-    def factory_method(
-        self,
-        building_type: str,
-        id: int,
-        x: float,
-        y: float,
-        data: pd.DataFrame,
-        player: int,
-    ) -> ProductionBuilding:
-        return SiegeWorkshop(
-            building_type=building_type,
-            units=SiegeWorkshopUnits,
-            id=id,
-            x=x,
-            y=y,
-            data=data,
-            player=player,
-        )
+    @property
+    def data(self):
+        return self._data
 
-    def create_production_building_and_remove_used_id(
-        self, inputs_data: pd.DataFrame, player: int
-    ):
-        return super().create_production_building_and_remove_used_id(
-            "Siege Workshop", SiegeWorkshopUnits, inputs_data, player=player
-        )
+    @property
+    def player(self):
+        return self._player
 
+    @property
+    def built_at(self):
+        return self._built_at
 
-class TownCentreBuildingFactory(AbstractProductionBuildingFactory):
-    def factory_method(
-        self,
-        building_type: str,
-        id: int,
-        x: float,
-        y: float,
-        data: pd.DataFrame,
-        player: int,
-    ) -> ProductionBuilding:
-        return TownCentre(
-            building_type=building_type,
-            units=TownCentreUnitsAndTechs,
-            id=id,
-            x=x,
-            y=y,
-            data=data,
-            player=player,
-        )
 
-    def create_production_building_and_remove_used_id(
+class ProductionEngine:
+    """Identifies every production building a player made and creates the Production Building object for each, with its
+    type, location and, critically, its ID, in a single pass over the player's inputs.
+
+    Because of the structure of the input data, a building's ID is only known from the units queued (or technologies
+    researched) in it - the payload.object_ids of those inputs. Each object ID is given the building type whose units were
+    queued in it most often, then the IDs of each type are paired in ascending order with the buildings of that type in the
+    order they were built (IDs cannot be re-used, so later buildings have larger IDs). An input made with several buildings
+    selected, or of a unit made by several types (e.g. Huskarls at the Barracks and Castle), counts less towards each, and
+    types the player never built are not counted. Ties go to the type that makes the fewest units (e.g. Serjeants are made
+    at the Castle and Donjon - a tie goes to the Donjon).
+
+    The building types modelled, with their units, are in ProductionBuildingUnits. Types with a class of their own are in
+    BUILDING_CLASSES, every other type is a TrainingBuilding.
+    """
+
+    BUILDING_CLASSES: Dict[str, type[ProductionBuilding]] = {
+        "Town Center": TownCentre,
+        "Archery Range": ArcheryRange,
+        "Barracks": Barracks,
+        "Stable": Stable,
+        "Siege Workshop": SiegeWorkshop,
+    }
+
+    def create_production_buildings(
         self,
         inputs_data: pd.DataFrame,
         player: int,
         position_x: float = None,
         position_y: float = None,
-    ):
-        # Hack for town centres - in non-Nomad games, we need to add a line for the first town centre because it is not built
-        check_for_build_town_centre = inputs_data.loc[
-            (inputs_data["type"] == "Build")
-            & (inputs_data["param"] == "Town Center")
-            & (inputs_data["timestamp"] < pd.Timedelta(seconds=100)),
-            :,
-        ]  # give 100 seconds incase of Nomad start
-
-        if check_for_build_town_centre.empty:
-            # Create the data for this
-            id_of_first_tc = inputs_data.loc[
-                inputs_data["param"] == "Villager", "payload.object_ids"
-            ].min()  # Hack - get this from the villagers created
-            initial_tc_cols = [
-                "timestamp",
-                "type",
-                "param",
-                "player",
-                "payload.object_ids",
-                "position.x",
-                "position.y",
+        building_types: Iterable[str] | None = None,
+        civilisation: str | None = None,
+    ) -> Dict[str, List[ProductionBuilding] | None]:
+        """Identify all the Production Buildings and Create them
+
+        :param inputs_data: the player's inputs
+        :param player: the player's number
+        :param position_x: x of the player's starting Town Centre, which is not built in non-Nomad games
+        :param position_y: y of the player's starting Town Centre
+        :param building_types: the types of building to model, defaults to every type in ProductionBuildingUnits. Types
+            that share no units (e.g. the Town Center and the rest) can be modelled separately with the same results
+        :param civilisation: the player's civilisation, for its unit creation times
+        :return: the buildings of each type, in the order they were built. None for a type that was never built, and an
+            empty list for one that never produced anything
+        :rtype: Dict[str, List[ProductionBuilding] | None]
+        """
+        building_types = list(building_types) if building_types is not None else list(ProductionBuildingUnits)
+        with span("production_buildings"):
+            return self._create_production_buildings(
+                inputs_data, player, position_x, position_y, building_types, civilisation
+            )
+
+    def _create_production_buildings(
+        self,
+        inputs_data: pd.DataFrame,
+        player: int,
+        position_x: float | None,
+        position_y: float | None,
+        building_types: List[str],
+        civilisation: str | None,
+    ) -> Dict[str, List[ProductionBuilding] | None]:
+        builds = self.buildings_built(inputs_data, building_types, position_x, position_y, civilisation)
+
+        # Membership table of unit -> building types that produce it. 24 Jan note units now includes TECHNOLOGIES
+        units = pd.Index(pd.unique(np.concatenate([ProductionBuildingUnits[b] for b in building_types])))
+        unit_membership = np.zeros((len(units), len(building_types)), dtype=bool)
+        for type_index, building_type in enumerate(building_types):
+            unit_membership[units.get_indexer(ProductionBuildingUnits[building_type]), type_index] = True
+
+        relevent_units_queued = inputs_data.loc[
+            inputs_data["param"].isin(units), ["timestamp", "type", "param", "payload.object_ids"]
+        ]
+
+        # Discovery - the payload object IDs are the buildings queued in. This is a list of buildings, so split into
+        # one (input, building ID) pair per building - the input is counted in each of the buildings it lists
+        object_ids = relevent_units_queued["payload.object_ids"].reset_index(drop=True).explode().dropna()
+        input_positions = object_ids.index.to_numpy()
+        id_codes, building_ids = pd.factorize(object_ids.to_numpy(), sort=True)
+        pair_membership = unit_membership[units.get_indexer(relevent_units_queued["param"].to_numpy())[input_positions]]
+
+        # Each building ID is the type whose units were queued in it the most. Ambiguous evidence counts for less -
+        # inputs are shared between the buildings selected, and units between the types that make them. Only types the
+        # player built are counted, unless none of the types that make a unit were built (e.g. the starting Town Centre)
+        type_was_built = np.isin(building_types, builds["param"].to_numpy())
+        pair_built_membership = pair_membership & type_was_built
+        pair_built_membership[~pair_built_membership.any(axis=1)] = pair_membership[~pair_built_membership.any(axis=1)]
+        buildings_selected = np.bincount(input_positions, minlength=len(relevent_units_queued))[input_positions]
+        pair_weights = (
+            pair_built_membership / pair_built_membership.sum(axis=1, keepdims=True) / buildings_selected[:, None]
+        )
+        votes = np.zeros((len(building_ids), len(building_types)))
+        np.add.at(votes, id_codes, pair_weights)
+        # On a tie the type that makes the fewest units wins, as its units are the more specific evidence - e.g. a
+        # Donjon over a Castle for Serjeants. Then the first type
+        number_of_units = np.array([len(ProductionBuildingUnits[building_type]) for building_type in building_types])
+        is_most_voted = np.isclose(votes, votes.max(axis=1, keepdims=True))
+        type_of_id = np.where(is_most_voted, -number_of_units, np.iinfo(np.int64).min).argmax(axis=1)
+
+        # Pair the buildings of each type in the order they were built with their IDs - remove unused buildings
+        production_buildings = {}
+        modelled = np.zeros(len(building_ids), dtype=bool)
+        builds_by_type = dict(tuple(builds.groupby("param", sort=False)))
+        for type_index, building_type in enumerate(building_types):
+            if building_type not in builds_by_type:
+                # TODO handle when it should not create the object; log m
+                production_buildings[building_type] = None
+                continue
+            relevent_buildings_produced = builds_by_type[building_type]
+            ids_of_type = np.flatnonzero(type_of_id == type_index)  # Ascending, as building_ids is sorted
+
+            if len(relevent_buildings_produced) < len(ids_of_type):
+                record("producing_from_more_buildings_than_built", building_type)  # Summarised per game, see diagnostics
+            production_buildings[building_type] = list(
+                zip(
+                    ids_of_type,
+                    relevent_buildings_produced["position.x"],
+                    relevent_buildings_produced["position.y"],
+                    relevent_buildings_produced["completed"],
+                )
+            )
+            modelled[[id_code for id_code, _, _, _ in production_buildings[building_type]]] = True
+
+        # Units can only be dispatched to the buildings selected that are modelled and can produce them
+        can_produce = pair_membership[np.arange(len(id_codes)), type_of_id[id_codes]] & modelled[id_codes]
+        data_of_buildings = self.dispatch_units(
+            inputs_data,
+            units,
+            building_ids,
+            modelled,
+            id_codes[can_produce],
+            input_positions[can_produce],
+            civilisation,
+        )
+
+        for building_type, buildings in production_buildings.items():
+            if buildings is None:
+                continue
+            production_buildings[building_type] = [
+                self.BUILDING_CLASSES.get(building_type, TrainingBuilding)(
+                    building_type=building_type,
+                    units=ProductionBuildingUnits[building_type],
+                    id=building_ids[id_code],
+                    x=x,
+                    y=y,
+                    data=data_of_buildings[id_code][0],
+                    player=player,
+                    built_at=built_at,
+                    produced=data_of_buildings[id_code][1],
+                    busy=data_of_buildings[id_code][2],
+                    civilisation=civilisation,
+                )
+                for id_code, x, y, built_at in buildings
             ]
-            initial_tc_vals = [
-                [
-                    pd.Timedelta(-150),
-                    "Build",
-                    "Town Center",
-                    player,
-                    id_of_first_tc,
-                    position_x,
-                    position_y,
-                ]
-            ]  # note -150 as takes 150 seconds to build
-
-            tc_df = pd.DataFrame(initial_tc_vals, columns=initial_tc_cols)
-            # concat it onto the inputs data and then the rest of the logic should handle correctly
-            inputs_data = pd.concat([tc_df, inputs_data], ignore_index=True)
-
-        return super().create_production_building_and_remove_used_id(
-            "Town Center", TownCentreUnitsAndTechs, inputs_data, player=player
+
+        return production_buildings
+
+    @staticmethod
+    def dispatch_units(
+        inputs_data: pd.DataFrame,
+        units: pd.Index,
+        building_ids: np.ndarray,
+        modelled: np.ndarray,
+        id_codes: np.ndarray,
+        input_positions: np.ndarray,
+        civilisation: str | None = None,
+    ) -> Dict[int, Tuple[pd.DataFrame, pd.DataFrame, pd.DataFrame]]:
+        """Work out which building each unit queued went to, by simulating all of the player's production buildings at
+        once - see simulation. A queue command with several buildings selected is split between them, and unqueues are
+        applied to the building they were made in.
+
+        :param inputs_data: the player's inputs
+        :param units: every unit and technology produced by a production building
+        :param building_ids: building IDs, indexed by ID code
+        :param modelled: whether each ID code is a building that is modelled
+        :param id_codes: ID code of each (input, building ID) pair where the building can produce the input's unit
+        :param input_positions: position of each pair's input amongst the inputs of units
+        :param civilisation: the player's civilisation, for its unit creation times
+        :return: for each modelled building (by ID code), its inputs - one row per unit dispatched to it and per
+            unqueue - the units it produced and the periods it was busy (see ProductionBuilding.produce_units)
+        :rtype: Dict[int, Tuple[pd.DataFrame, pd.DataFrame, pd.DataFrame]]
+        """
+        is_order = inputs_data["param"].isin(units).to_numpy()
+        is_unqueue = (inputs_data["type"] == "Unqueue").to_numpy()
+        events = inputs_data.loc[is_order | is_unqueue]
+        is_order = is_order[is_order | is_unqueue]
+        order_positions = np.flatnonzero(is_order)
+
+        amount = events.get("payload.amount", pd.Series(1, index=events.index))
+        slot = events.get("payload.slot_id", pd.Series(0, index=events.index))
+        events = events[["timestamp", "type", "param", "payload.object_ids"]].assign(
+            type=events["type"].astype(object),
+            amount=amount.fillna(1).clip(lower=1).astype(np.int64).to_numpy(),
+            slot=slot.fillna(0).astype(np.int64).to_numpy(),
+        )
+
+        # Buildings each order can be dispatched to, in the order they were selected
+        buildings = [[] for _ in range(len(events))]
+        for input_position, id_code in zip(order_positions[input_positions].tolist(), id_codes.tolist()):
+            buildings[input_position].append(id_code)
+        # Unqueues apply to the first modelled building selected
+        unqueued_from = events["payload.object_ids"].where(~is_order).reset_index(drop=True).explode()
+        unqueued_from = unqueued_from[unqueued_from.notna()]
+        unqueued_codes = pd.Index(building_ids).get_indexer(unqueued_from.to_numpy())
+        unqueued_from = pd.Series(unqueued_codes, index=unqueued_from.index)
+        is_known = unqueued_codes >= 0  # building_ids is empty if nothing was queued in a building
+        is_known[is_known] = modelled[unqueued_codes[is_known]]
+        unqueued_from = unqueued_from[is_known]
+        unqueued_from = unqueued_from.groupby(level=0).first()
+        for event, id_code in unqueued_from.items():
+            buildings[event] = [id_code]
+
+        unit_names = events["param"].astype(object).str.replace(r"-|\s", "_", regex=True)
+        dispatched, busy = simulate_production(
+            events.assign(
+                param=unit_names,
+                duration=unit_creation_times(unit_names, UNIT_CREATION_TIMES, civilisation),
+                buildings=buildings,
+            )
         )
 
+        # Inputs of each building, in the order they were made - each unit dispatched to it and each unqueue
+        assignments = pd.DataFrame(
+            {
+                "event": np.concatenate([dispatched["event"].to_numpy(), unqueued_from.index.to_numpy()]),
+                "id_code": np.concatenate([dispatched["building_id"].to_numpy(), unqueued_from.to_numpy()]),
+            },
+            dtype=np.int64,
+        ).sort_values(["id_code", "event"], kind="stable")
+        building_inputs = events.drop(columns="payload.object_ids").rename(
+            columns={"amount": "payload.amount", "slot": "payload.slot_id"}
+        )
+        building_inputs["payload.amount"] = 1  # Each row is a single unit once dispatched
+        events_of_building = {
+            id_code: events_of_id.to_numpy() for id_code, events_of_id in assignments.groupby("id_code")["event"]
+        }
+
+        # Units each building produced and when it was busy - the buildings' queues are independent once the units are
+        # dispatched, so these are the same as simulating each building on its own inputs
+        units_of_building = dict(tuple(dispatched.groupby("building_id", sort=False)))
+        busy_of_building = dict(tuple(busy.groupby("building_id", sort=False)))
+        no_units, not_busy = dispatched.iloc[0:0], busy.iloc[0:0]
+        return {
+            id_code: (
+                building_inputs.iloc[events_of_building.get(id_code, [])],
+                ProductionBuilding.units_produced(units_of_building.get(id_code, no_units), unit_names.to_numpy()),
+                ProductionBuilding.busy_periods(busy_of_building.get(id_code, not_busy)),
+            )
+            for id_code in np.flatnonzero(modelled)
+        }
 
-# TODO - Castle, Dock, Monastery, etc.
+    @staticmethod
+    def buildings_built(
+        inputs_data: pd.DataFrame,
+        building_types: List[str],
+        position_x: float | None,
+        position_y: float | None,
+        civilisation: str | None = None,
+    ) -> pd.DataFrame:
+        """The Build inputs of production buildings, in the order they were made, with the time each was completed (the
+        buildings cannot produce anything while they are being constructed)"""
+        builds = inputs_data.loc[
+            (inputs_data["type"] == "Build") & inputs_data["param"].isin(building_types),
+            ["timestamp", "param", "position.x", "position.y", "payload.object_ids"],
+        ]
+        builds = builds.assign(param=builds["param"].astype(object))
+        build_times = BUILD_TIMES.lookup(builds["param"].str.replace(r"-|\s", "_", regex=True), civilisation)
+        builds["completed"] = builds["timestamp"] + construction_time(
+            pd.Series(build_times, index=builds.index).fillna(0), villagers_building(builds["payload.object_ids"])
+        )
+        builds = builds.drop(columns="payload.object_ids")
+
+        # Hack for town centres - in non-Nomad games, we need to add a line for the first town centre because it is not built
+        first_town_centre_built = (builds["param"] == "Town Center") & (
+            builds["timestamp"] < pd.Timedelta(seconds=100)
+        )  # give 100 seconds incase of Nomad start
+        if "Town Center" in building_types and not first_town_centre_built.any():
+            starting_town_centre = pd.DataFrame(
+                {
+                    "timestamp": [pd.Timedelta(0)],  # Already built at the start of the game
+                    "param": ["Town Center"],
+                    "position.x": [position_x],
+                    "position.y": [position_y],
+                    "completed": [pd.Timedelta(0)],
+                }
+            )
+            builds = pd.concat([starting_town_centre, builds], ignore_index=True) if not builds.empty else starting_town_centre
+        return builds
 
 
 if __name__ == "__main__":
@@ -707,7 +1022,5 @@ if __name__ == "__main__":
         r"Data\TestGameDataExploration\Player1_inputs.csv"
     )  # ..\..\
 
-    archery_ranges = ArcheryRangeProductionBuildingFactory().create_production_building_and_remove_used_id(
-        inputs_data=test_inputs, player=1
-    )
-    print(archery_ranges[0].produce_units())
+    production_buildings = ProductionEngine().create_production_buildings(inputs_data=test_inputs, player=1)
+    print(production_buildings["Archery Range"][0].produce_units())
@@ -1,22 +1,440 @@
 import os
+import subprocess
+import sys
+import numpy as np
 import pandas as pd
 import pytest
+from pathlib import Path
+from mgz.model import parse_match
 
+from agealyser import analyse_many
+from agealyser.agealyser_enums import BUILD_TIMES, RESEARCH_TIMES, UNIT_CREATION_TIMES, known_civilisations
+from agealyser.batch import write_results
+from agealyser.cli import main
+from agealyser.diagnostics import Diagnostics
+from agealyser.ingest import replay_summary
+from agealyser.instrumentation import Instrumentation
+from agealyser.cache import ReplayCache
 from agealyser.main import AgeGame, GamePlayer, AgeMap
+from agealyser.utils import ProductionEngine, dedupe_inputs
+
+REPLAYS = Path(__file__).parents[1] / "Data" / "RawAoe2RecordBytes"
+TEST_GAMES = Path(__file__).parent / "Test_Games"
+GAME = REPLAYS / "AOE2ReplayBinary_15.aoe2record"
+BROKEN_GAME = REPLAYS / "AOE2ReplayBinary_10.aoe2record"  # empty file - cannot be parsed by MGZ
+INPUT_COLUMNS = ["timestamp", "type", "param", "payload.object_ids", "position.x", "position.y"]
+
+
+@pytest.fixture
+def game() -> AgeGame:
+    """A freshly parsed game - nothing has been analysed yet"""
+    return AgeGame(GAME)
+
+
+def player_inputs(rows: list, payload_columns: list | None = None) -> pd.DataFrame:
+    """Hand-built inputs of a player from rows of (seconds, type, param, object IDs, x, y, *payload_columns)"""
+    inputs = pd.DataFrame(rows, columns=INPUT_COLUMNS + (payload_columns or []))
+    inputs["timestamp"] = pd.to_timedelta(inputs["timestamp"], unit="s")
+    return inputs
+
+
+def production_buildings(rows: list, payload_columns: list | None = None, civilisation: str | None = None) -> dict:
+    """Model the production buildings of hand-built inputs (see player_inputs), with the starting Town Centre at 5,5"""
+    return ProductionEngine().create_production_buildings(
+        player_inputs(rows, payload_columns), player=1, position_x=5.0, position_y=5.0, civilisation=civilisation
+    )
 
 
 def test_regression_testing():
     results = []
     # get the suite of test games
-    test_files = [game for game in os.listdir(r"tests\\Test_Games") if ".aoe2record" in game]  # TODO fix pathing when automating
-    test_games = [AgeGame(r"tests\\Test_Games\\" + file) for file in test_files]
+    test_files = sorted(game for game in os.listdir(TEST_GAMES) if ".aoe2record" in game)
+    test_games = [AgeGame(TEST_GAMES / file) for file in test_files]
 
     # run the package on these
     results = pd.concat([game.advanced_parser(include_map_analyses=True) for game in test_games], axis=1).T
-    correct_results = pd.read_parquet(r"tests\\Test_Games\\regression_testing_test_results.parquet")
+    correct_results = pd.read_parquet(TEST_GAMES / "regression_testing_test_results.parquet")
+    # Parquet gives back the starting locations as arrays rather than tuples
+    correct_results = correct_results.map(lambda x: tuple(x) if isinstance(x, np.ndarray) else x)
     results = results.astype(correct_results.dtypes.to_dict())
 
     assert pd.testing.assert_frame_equal(results, correct_results) is None
 
     # save data
     # results.to_parquet(r"tests\\Test_Games\\regression_testing_test_results.parquet")
+
+
+def test_analyse_many_isolates_failures():
+    results, failures = analyse_many([BROKEN_GAME, GAME], workers=2)
+
+    assert results.index.to_list() == [str(GAME)]
+    assert failures["path"].to_list() == [str(BROKEN_GAME)]
+    assert failures["error"].to_list() == ["MGZParserException"]
+
+
+def test_cached_game_matches_parsed_game(tmp_path):
+    cache = ReplayCache(tmp_path)
+
+    parsed_game = AgeGame(GAME, cache=cache)
+    cached_game = AgeGame(GAME, cache=cache)
+
+    assert parsed_game.match is not None and cached_game.match is None  # Second game is read from the cache
+    pd.testing.assert_frame_equal(parsed_game.all_inputs_df, cached_game.all_inputs_df)
+    pd.testing.assert_series_equal(parsed_game.advanced_parser(), cached_game.advanced_parser())
+
+
+def test_game_is_analysed_when_it_cannot_be_cached(tmp_path, monkeypatch):
+    cache = ReplayCache(tmp_path)
+
+    def missing_pyarrow(*args, **kwargs):
+        raise ImportError("Unable to find a usable engine; tried using: 'pyarrow'")
+
+    monkeypatch.setattr(pd.DataFrame, "to_parquet", missing_pyarrow)
+
+    assert not AgeGame(GAME, cache=cache).advanced_parser(include_map_analyses=False).empty
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_advanced_parser_sections_are_subset_of_full_analysis(game):
+    uptimes = game.advanced_parser(sections=["uptimes"])
+
+    assert "game_map" not in game.__dict__  # The map is not analysed unless requested
+    # Only the town centres are modelled for the age up times - the other production buildings are for the opening
+    assert all("production_buildings" not in player.__dict__ for player in game.players)
+    walls_game = AgeGame(GAME)
+    walls_game.advanced_parser(sections=["walls"])
+    assert all("production_buildings" not in player.__dict__ for player in walls_game.players)
+    assert "Player1.OpeningStrategy.FeudalTime" in uptimes
+    # mgz cannot read the queue commands of these games, so no villagers are known and the idle time is not measured
+    assert pd.isna(uptimes["Player1.OpeningStrategy.DarkAgeTownCentreIdleTime"])
+    full_results = AgeGame(GAME).advanced_parser()
+    pd.testing.assert_series_equal(uptimes, full_results[uptimes.index])
+
+
+def test_metadata_only_matches_full_parse(game):
+    summary = AgeGame.metadata_only(GAME)
+
+    assert summary["Duration"] == pd.Timedelta(game.game_duration)
+    assert summary["Rated"] == game.rated_game
+    for player in game.players:
+        assert summary[f"Player{player.number}.Civilisation"] == player.civilisation
+        assert summary[f"Player{player.number}.Elo"] == player.elo
+        assert summary[f"Player{player.number}.Winner"] == player.player_won
+
+
+@pytest.mark.parametrize(
+    "game_file",
+    [REPLAYS / "AOE2ReplayBinary_11.aoe2record", GAME, TEST_GAMES / "SD-AgeIIDE_Replay_366825453.aoe2record"],
+)
+def test_replay_summary_matches_mgz_model(game_file):
+    # replay_summary reads mgz.fast internals - this catches an mgz upgrade changing them
+    with open(game_file, "rb") as g:
+        summary = replay_summary(g)
+    with open(game_file, "rb") as g:
+        match = parse_match(g)
+
+    assert (summary["map"], summary["duration"], summary["rated"]) == (match.map.name, match.duration, match.rated)
+    assert [
+        (player["number"], player["name"], player["civilization"], player["rate_snapshot"], player["winner"])
+        for player in summary["players"]
+    ] == [(p.number, p.name, p.civilization, p.rate_snapshot, p.winner) for p in match.players]
+
+
+def test_write_results_streams_batches_to_parquet(tmp_path):
+    games = [GAME, BROKEN_GAME] * 2
+
+    failures = write_results(games, tmp_path, batch_size=1, workers=2, include_map_analyses=False)
+
+    written = sorted(tmp_path.glob("results-*.parquet"))
+    assert [file.name for file in written] == ["results-00000.parquet", "results-00001.parquet"]
+    assert len(failures) == 2
+    assert pd.read_parquet(written[0]).index.to_list() == [str(games[0])]
+
+
+def test_cli_batches_need_an_output_directory(tmp_path):
+    existing_file = tmp_path / "results"
+    existing_file.touch()
+
+    for output in [tmp_path / "results.csv", existing_file]:
+        with pytest.raises(SystemExit):
+            main([str(tmp_path), "--batch-size", "10", "--output", str(output)])
+    assert not (tmp_path / "results.csv").exists()
+
+
+@pytest.mark.parametrize("table", [BUILD_TIMES, RESEARCH_TIMES, UNIT_CREATION_TIMES])
+@pytest.mark.parametrize("civilisation", known_civilisations() + [None])
+def test_timing_tables_match_enum_getters(table, civilisation):
+    expected = [table.enum.get(item, civilisation=civilisation) for item in table.items]
+
+    assert table.lookup(table.items, civilisation).tolist() == pytest.approx(expected)
+    assert table.get(table.items[0], civilisation) == expected[0]
+
+
+def test_dedupe_inputs_drops_repeated_queues():
+    inputs = pd.DataFrame(
+        {
+            "timestamp": pd.to_timedelta([10, 10.1, 30, 30.1, 30.2, 40], unit="s"),
+            "type": pd.Categorical(["Queue", "Queue", "Queue", "Queue", "Build", "Queue"]),
+            "param": pd.Categorical(["Villager", "Villager", "Archer", "Archer", "House", "Archer"]),
+            "payload.object_ids": [[1], [1], [2, 3], [2, 3], [4], [2, 3]],
+        }
+    )
+
+    assert dedupe_inputs(inputs).index.to_list() == [0, 1, 2, 4, 5]  # Before the cutoff, duplicates are kept
+    assert dedupe_inputs(inputs, cutoff=pd.Timedelta(0)).index.to_list() == [0, 2, 4, 5]
+    assert dedupe_inputs(inputs, window=pd.Timedelta(0)).index.to_list() == [0, 1, 2, 3, 4, 5]
+
+
+def test_instrumentation_records_each_stage():
+    finished_spans = []
+
+    with Instrumentation(trace_memory=True, callback=finished_spans.append) as instrumentation:
+        AgeGame(GAME).advanced_parser(sections=["uptimes", "opening"])
+    records = instrumentation.to_dataframe()
+
+    assert {"parse", "normalise", "player", "uptimes", "opening", "production_buildings"} <= set(records["stage"])
+    assert "map" not in set(records["stage"])
+    assert len(finished_spans) == len(records)
+    assert (records["replay"] == str(GAME)).all()
+    assert (records.loc[records["stage"] == "opening", "player"].to_list()) == [1, 2]
+    assert (records[["wall_time", "cpu_time", "peak_memory"]] >= 0).all().all()
+
+
+def test_batch_analysis_collects_spans_from_workers():
+    games = [GAME, BROKEN_GAME]
+    instrumentation = Instrumentation()
+
+    analyse_many(games, workers=2, sections=["uptimes"], instrumentation=instrumentation)
+    records = instrumentation.to_dataframe()
+
+    # One game span per replay, including the one that failed, with the stages of each game labelled by replay
+    assert sorted(records.loc[records["stage"] == "game", "replay"]) == sorted(str(game) for game in games)
+    assert "parse" in set(records.loc[records["replay"] == str(games[0]), "stage"])
+
+
+def test_import_has_no_side_effects(tmp_path):
+    # Fresh interpreter, as the test session has already imported everything
+    check = (
+        "import logging, sys, agealyser.main;"
+        "assert not logging.getLogger().handlers;"
+        "assert not {'scipy.ndimage', 'scipy.spatial', 'shapely'} & set(sys.modules)"
+    )
+    subprocess.run([sys.executable, "-c", check], cwd=tmp_path, check=True)
+    assert not list(tmp_path.iterdir())  # No log file written to the working directory
+
+
+def test_diagnostics_summarise_unknown_items_once(caplog):
+    with Diagnostics() as diagnostics:
+        for _ in range(3):
+            assert not UNIT_CREATION_TIMES.has_value("Not_A_Unit")
+        assert not RESEARCH_TIMES.has_value("Not_A_Tech")
+    UNIT_CREATION_TIMES.has_value("Not_A_Unit")  # Not counted once the diagnostics are no longer active
+
+    assert diagnostics.counts == {("unknown_unit", "Not_A_Unit"): 3, ("unknown_technology", "Not_A_Tech"): 1}
+    with caplog.at_level("WARNING", logger="agealyser"):
+        diagnostics.log_summary(game="game.aoe2record")
+    assert len(caplog.records) == 1
+    assert "unknown_unit: Not_A_Unit (3)" in caplog.text
+
+
+def test_resource_islands_are_numbered_per_resource():
+    age_map = AgeMap.__new__(AgeMap)  # Only the map size is needed to label islands
+    age_map.map_size_int = 10
+    tiles = pd.DataFrame(
+        {
+            "name": ["Gold Mine", "Gold Mine", "Tree", "Tree", "Gold Mine", "Tree", "Wild Boar"],
+            "x": [1, 2, 2, 3, 8, 8, 5],
+            "y": [1, 2, 3, 3, 8, 9, 5],
+            "instance_id": range(7),
+        }
+    )
+
+    islands = age_map.identify_islands_of_resources(tiles, resources=["Gold Mine", "Tree"])
+
+    # Diagonal gold tiles join, but the touching trees and gold do not - each resource is numbered from 1
+    assert islands["resource_kind"].to_list() == ["Gold Mine", "Gold Mine", "Tree", "Tree", "Gold Mine", "Tree"]
+    assert islands["island_id"].to_list() == [1, 1, 1, 1, 2, 2]
+
+
+@pytest.mark.parametrize(
+    "rows, payload_columns, expected",
+    [
+        pytest.param(
+            [
+                (10, "Queue", "Villager", [1], None, None),
+                (200, "Build", "Barracks", [50], 20.0, 30.0),
+                (210, "Build", "Archery Range", [51], 40.0, 40.0),
+                (300, "Queue", "Militia", [100], None, None),
+                (310, "Queue", "Archer", [101], None, None),
+                (320, "Queue", "Skirmisher", [100, 101], None, None),  # Both buildings selected - only the range makes it
+                (900, "Build", "Castle", [52], 60.0, 60.0),
+                (1000, "Queue", "Longbowman", [102], None, None),
+                (1010, "Queue", "Huskarl", [102], None, None),  # Also made at the Barracks
+                (1100, "Build", "Donjon", [53], 70.0, 70.0),
+                (1200, "Queue", "Serjeant", [103], None, None),  # Also made at the Castle
+                (1300, "Build", "Krepost", [54], 80.0, 80.0),
+                (1400, "Queue", "Konnik", [104], None, None),  # Also made at the Castle
+            ],
+            None,
+            {
+                "Town Center": [(1, 5.0, ["Villager"])],  # Starting Town Centre is added
+                "Barracks": [(100, 20.0, ["Militia"])],
+                "Archery Range": [(101, 40.0, ["Archer", "Skirmisher"])],
+                "Castle": [(102, 60.0, ["Longbowman", "Huskarl"])],
+                "Donjon": [(103, 70.0, ["Serjeant"])],
+                "Krepost": [(104, 80.0, ["Konnik"])],
+                "Stable": None,
+                "Dock": None,
+            },
+            id="one type per building",
+        ),
+        pytest.param(
+            [
+                (100, "Build", "Archery Range", [50], 20.0, 30.0, None, None),
+                (110, "Build", "Archery Range", [51], 40.0, 40.0, None, None),
+                (300, "Queue", "Archer", [100, 101], None, None, 4, None),  # Split between both ranges
+                (301, "Queue", "Skirmisher", [100], None, None, 1, None),
+                (302, "Unqueue", None, [100], None, None, None, 1),  # Removes the Skirmisher, behind the Archers
+            ],
+            ["payload.amount", "payload.slot_id"],
+            {"Archery Range": [(100, 20.0, ["Archer", "Archer"]), (101, 40.0, ["Archer", "Archer"])]},
+            id="dispatch and unqueue",
+        ),
+        pytest.param(
+            [
+                (100, "Build", "House", [50], 20.0, 30.0),
+                (200, "Unqueue", None, [777], None, None),  # No building is known to have queued anything
+            ],
+            None,
+            {"Town Center": [], "Archery Range": None},
+            id="unqueue without queued units",
+        ),
+    ],
+)
+def test_production_engine_assigns_buildings(rows, payload_columns, expected):
+    buildings = production_buildings(rows, payload_columns)
+
+    for building_type, expected_buildings in expected.items():
+        if expected_buildings is None:
+            assert buildings[building_type] is None
+            continue
+        assert [
+            (building.id, building.x, building.produce_units()["param"].to_list()) for building in buildings[building_type]
+        ] == expected_buildings
+
+
+@pytest.mark.parametrize(
+    "rows, payload_columns, civilisation, building_type, created",
+    [
+        pytest.param(
+            [
+                (100, "Build", "Archery Range", [50], 20.0, 30.0, None),
+                (110, "Build", "Archery Range", [51], 40.0, 40.0, None),
+                (300, "Queue", "Archer", [100, 101], None, None, 4),  # Split between both ranges
+            ],
+            ["payload.amount"],
+            None,
+            "Archery Range",
+            [335, 370],  # The second Archer waits for the first in the same range
+            id="queued behind",
+        ),
+        pytest.param(
+            [(100, "Build", "Stable", [50], 20.0, 30.0), (200, "Queue", "Knight", [100], None, None)],
+            None,
+            "Franks",
+            "Stable",
+            [230],
+            id="default civilisation",
+        ),
+        pytest.param(
+            [(100, "Build", "Stable", [50], 20.0, 30.0), (200, "Queue", "Knight", [100], None, None)],
+            None,
+            "Huns",
+            "Stable",
+            [225],  # Huns make Knights 20% faster
+            id="civilisation override",
+        ),
+    ],
+)
+def test_production_engine_creation_times(rows, payload_columns, civilisation, building_type, created):
+    buildings = production_buildings(rows, payload_columns, civilisation)
+
+    for building in buildings[building_type]:
+        assert building.produce_units()["UnitCreatedTimestamp"].dt.total_seconds().to_list() == created
+
+
+def test_production_building_idle_time_and_utilisation():
+    archery_range = production_buildings(
+        [
+            (30, "Build", "Archery Range", [50], 20.0, 30.0),  # One villager - completed 50s later
+            (100, "Queue", "Archer", [100], None, None),
+            (110, "Queue", "Archer", [100], None, None),  # Waits for the first Archer - one busy period
+            (300, "Queue", "Archer", [100], None, None),
+        ]
+    )["Archery Range"][0]
+
+    busy = archery_range.busy_intervals()
+    assert busy["start"].dt.total_seconds().to_list() == [100, 300]
+    assert busy["end"].dt.total_seconds().to_list() == [170, 335]
+    # Idle from when it was completed (80s) rather than the start of the game or when it was placed
+    assert archery_range.built_at == pd.Timedelta(seconds=80)
+    assert archery_range.count_building_idle_time(pd.Timedelta(0), pd.Timedelta(seconds=400)) == 320 - 105
+    timeline = archery_range.utilisation_timeline(end=pd.Timedelta(seconds=400))
+    assert timeline.index[0] == pd.Timedelta(minutes=1)
+    assert timeline.iloc[1] == pytest.approx(50 / 60)  # Busy from 100s to 170s
+
+
+def test_busy_intervals_come_from_the_simulation():
+    archery_range = production_buildings(
+        [
+            (60, "Build", "Archery Range", [50], 20.0, 30.0, None),
+            (100, "Queue", "Archer", [100], None, None, None),
+            (110, "Unqueue", None, [100], None, None, 0),  # Cancels the Archer in production
+        ],
+        ["payload.slot_id"],
+    )["Archery Range"][0]
+
+    # Nothing was produced, but the range was busy until the Archer was cancelled
+    assert archery_range.produce_units().empty
+    busy = archery_range.busy_intervals()
+    assert list(zip(busy["start"].dt.total_seconds(), busy["end"].dt.total_seconds())) == [(100, 110)]
+
+
+def test_technologies_take_multi_word_techs_from_the_town_centre_model(game):
+    player = game.players[0]
+
+    tc_techs = player.tc_units_and_techs
+    castle_age = tc_techs.loc[tc_techs["param"] == "Castle_Age", "UnitCreatedTimestamp"].iloc[0]
+
+    # The modelled time overrides the click plus research time, which differs as the town centre was still busy
+    assert player.technologies["Castle Age"] == castle_age
+    assert player.technology_table.loc["Castle Age", "CompletedTimestamp"] != castle_age
+
+
+def test_building_timeline_is_shared_by_the_analysis(game):
+    player = game.players[0]
+
+    timeline = player.building_timeline
+
+    assert timeline.index.is_monotonic_increasing  # In the order they were placed
+    assert (timeline["timestamp"] == timeline["PlacedTimestamp"] + timeline["TimeToBuild"]).all()
+    assert (timeline["NumberVillsBuilding"] >= 1).all()
+    houses = player.buildings_placed("House", placed_before=pd.Timedelta(minutes=5))
+    assert (houses["Building"] == "House").all() and (houses["PlacedTimestamp"] < pd.Timedelta(minutes=5)).all()
+    game.advanced_parser()
+    assert player.building_timeline is timeline  # Computed once for every section of the analysis
+
+
+def test_technology_table_has_one_row_per_technology():
+    game = AgeGame(REPLAYS / "AOE2ReplayBinary_11.aoe2record")
+    player = game.players[0]
+
+    table = player.technology_table
+
+    assert table.index.is_unique and set(table.index) == set(player.research_techs["param"])
+    feudal_age = table.loc["Feudal Age"]
+    assert feudal_age["ResearchTime"] == RESEARCH_TIMES.get("Feudal_Age", civilisation=player.civilisation)
+    assert player.age_up_times[2] == feudal_age["ClickedTimestamp"] + pd.Timedelta(seconds=feudal_age["ResearchTime"])
+    assert player.technologies.keys() >= set(table.index)
+    # Research order is kept, not sorted alphabetically
+    assert list(player.technologies)[: len(table)] == list(table.index)